@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+benchmarks/compare
+------------------
+
+Compares two result files written by run.py, e.g. from before and after a
+change:
+
+    python benchmarks/compare.py [--threshold 1.1] old.json new.json
+
+Prints the minimum time of every scenario in both and their ratio, and exits
+with status 1 if any scenario got slower by more than the threshold.
+"""
+
+import sys
+import json
+from optparse import OptionParser
+
+def load(filename):
+    results_file = open(filename)
+    try:
+        return json.load(results_file)
+    finally:
+        results_file.close()
+
+def compare(old, new, threshold, out):
+    """
+    print old and new timings side by side
+
+    @param old: results as written by run.py
+    @param new: results as written by run.py
+    @param threshold: ratio of new to old time counted as a regression
+    @param out: file to print to
+    @return: names of the scenarios that regressed
+    @rtype: list
+    """
+    if old.get('generator') != new.get('generator'):
+        print >> out, "Warning: the results are for different projects"
+    if old.get('jobs') != new.get('jobs'):
+        print >> out, "Warning: the results are for different numbers of jobs"
+    print >> out, "%-14s %10s %10s %8s" % ('scenario', 'old', 'new', 'ratio')
+    regressions = []
+    for scenario in sorted(set(old['scenarios']) & set(new['scenarios'])):
+        old_time = old['scenarios'][scenario]['min']
+        new_time = new['scenarios'][scenario]['min']
+        if old_time:
+            ratio = new_time / old_time
+        else:
+            ratio = 1.0
+        marker = ''
+        if ratio > threshold:
+            regressions.append(scenario)
+            marker = ' slower'
+        print >> out, "%-14s %9.3fs %9.3fs %7.2fx%s" % (
+            scenario, old_time, new_time, ratio, marker
+        )
+    return regressions
+
+def main():
+    parser = OptionParser(usage="%prog [options] old.json new.json")
+    parser.add_option('--threshold', type="float", default=1.1,
+            help="Ratio of new to old time counted as a regression "
+            "[%default]")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected two result files")
+    if compare(load(args[0]), load(args[1]), options.threshold, sys.stdout):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
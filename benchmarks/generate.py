@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+benchmarks/generate
+-------------------
+
+Builds synthetic projects to benchmark sr with. Projects are laid out like
+the ones `sr create` makes and are generated from a seed, so the same
+parameters always give the same project.
+
+    python benchmarks/generate.py [options] /path/to/new/project
+
+Run with --help for the parameters: number of pages, directory depth, body
+size, number of headers, code blocks per page and template complexity.
+"""
+
+import os
+import sys
+import random
+from ConfigParser import SafeConfigParser
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'sr'))
+from sr import create
+
+DEFAULTS = {
+    'pages': 500,
+    'depth': 3,
+    'fanout': 4,
+    'body_size': 4000,
+    'headers': 4,
+    'code_blocks': 0.5,
+    'templates': 2,
+    'template_blocks': 5,
+    'seed': 1,
+}
+
+WORDS = ('static rendering page content template markdown source output '
+         'header project directory build change hash cache render list '
+         'python code block paragraph link emphasis strong text file').split()
+
+CODE_LINES = (
+    'def %(word)s_%(number)d(value):',
+    '    """%(word)s %(number)d"""',
+    '    result = [item * %(number)d for item in value if item]',
+    '    if not result:',
+    '        raise ValueError("%(word)s")',
+    '    return dict(zip(result, range(%(number)d)))',
+)
+
+def sentence(rng, words=12, markup=True):
+    """
+    some words ending in a full stop, with the occasional markup
+    """
+    sentence_words = [rng.choice(WORDS) for index in range(words)]
+    if markup:
+        index = rng.randrange(words)
+        kind = rng.random()
+        if kind < 0.1:
+            sentence_words[index] = '*%s*' % sentence_words[index]
+        elif kind < 0.2:
+            sentence_words[index] = '**%s**' % sentence_words[index]
+        elif kind < 0.25:
+            sentence_words[index] = '[%s](http://example.com/%s)' % (
+                sentence_words[index], sentence_words[index]
+            )
+    return ' '.join(sentence_words).capitalize() + '.'
+
+def code_block(rng):
+    """
+    an indented python code block as understood by codehilite
+    """
+    lines = ['    :::python']
+    for index in range(rng.randint(1, 3)):
+        values = {'word': rng.choice(WORDS), 'number': rng.randint(1, 1000)}
+        lines.extend('    ' + line % values for line in CODE_LINES)
+    return '\n'.join(lines)
+
+def page_body(rng, body_size, code_blocks):
+    """
+    markdown text of roughly body_size bytes
+
+    @param code_blocks: average number of code blocks in the body
+    """
+    blocks = ['# %s' % sentence(rng, 4, False).rstrip('.')]
+    size = 0
+    while size < body_size:
+        if rng.random() < 0.15:
+            block = '## %s' % sentence(rng, 3, False).rstrip('.')
+        elif rng.random() < 0.1:
+            block = '\n'.join('* %s' % sentence(rng, 6)
+                              for index in range(rng.randint(2, 5)))
+        else:
+            block = ' '.join(sentence(rng) for index in
+                             range(rng.randint(2, 6)))
+        blocks.append(block)
+        size += len(block)
+    # whole blocks for the integer part, one more by chance for the rest
+    count = int(code_blocks)
+    if rng.random() < code_blocks - count:
+        count += 1
+    for index in range(count):
+        blocks.insert(rng.randint(1, len(blocks)), code_block(rng))
+    return '\n\n'.join(blocks) + '\n'
+
+def page_path(rng, number, depth, fanout):
+    """
+    relative path of a page, nested up to depth directories
+    """
+    parts = []
+    for level in range(rng.randint(0, depth)):
+        parts.append('dir%d' % rng.randint(1, fanout))
+    parts.append('page%d.txt' % number)
+    return os.path.join(*parts)
+
+def template_source(number, blocks):
+    """
+    a template with a number of loops and conditions over the page headers
+    """
+    lines = [
+        '<html><head><title>$title</title></head><body>',
+        '<!-- template %d -->' % number,
+    ]
+    for index in range(blocks):
+        lines.extend([
+            '<div class="block%d">' % index,
+            '<% if title %>',
+            '<h2>${title.upper()} %d</h2>' % index,
+            '<% endif %>',
+            '<ul>',
+            '<%% for item in range(%d) %%>' % (index % 5 + 1),
+            '<li class="${item % 2 and \'odd\' or \'even\'}">$title $item</li>',
+            '<% endfor %>',
+            '</ul>',
+            '</div>',
+        ])
+    lines.extend(['<div id="content">', '$content', '</div>',
+                  '</body></html>', ''])
+    return '\n'.join(lines)
+
+def generate(directory, pages=DEFAULTS['pages'], depth=DEFAULTS['depth'],
+             fanout=DEFAULTS['fanout'], body_size=DEFAULTS['body_size'],
+             headers=DEFAULTS['headers'], code_blocks=DEFAULTS['code_blocks'],
+             templates=DEFAULTS['templates'],
+             template_blocks=DEFAULTS['template_blocks'],
+             seed=DEFAULTS['seed']):
+    """
+    create a synthetic project
+
+    @param directory: where to create the project, must not exist yet
+    @type directory: string
+    @keyword pages: number of pages
+    @keyword depth: maximum number of directories a page is nested in
+    @keyword fanout: number of directories to choose from at each level
+    @keyword body_size: approximate size of a page body in bytes
+    @keyword headers: number of headers per page besides title and template
+    @keyword code_blocks: average number of code blocks per page, the
+                          codehilite addon is enabled if this isn't 0
+    @keyword templates: number of templates pages are spread across
+    @keyword template_blocks: number of loops and conditions per template
+    @keyword seed: seed for the random contents
+    """
+    rng = random.Random(seed)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        create(directory)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    if code_blocks:
+        config = SafeConfigParser()
+        config.read(os.path.join(directory, 'config.ini'))
+        config.set('markdown', 'addons', 'codehilite')
+        config_file = open(os.path.join(directory, 'config.ini'), 'w')
+        config.write(config_file)
+        config_file.close()
+    template_names = ['standard.html'] + ['template%d.html' % number for
+                                          number in range(1, templates)]
+    for number, template_name in enumerate(template_names):
+        template_file = open(os.path.join(directory, 'templates',
+                                          template_name), 'w')
+        template_file.write(template_source(number, template_blocks))
+        template_file.close()
+    for number in range(pages):
+        filename = os.path.join(directory, 'source',
+                                page_path(rng, number, depth, fanout))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        lines = ['title: %s' % sentence(rng, 4, False).rstrip('.')]
+        if number % len(template_names):
+            lines.append('template: %s' %
+                         template_names[number % len(template_names)])
+        for index in range(headers):
+            lines.append('header%d: %s' % (index, sentence(rng, 5, False)))
+        page_file = open(filename, 'w')
+        page_file.write('\n'.join(lines) + '\n\n' +
+                        page_body(rng, body_size, code_blocks))
+        page_file.close()
+
+def option_parser():
+    """
+    command line options for the generator parameters, shared with run.py
+    """
+    parser = OptionParser(usage="%prog [options] /path/to/new/project")
+    parser.add_option('--pages', type="int", default=DEFAULTS['pages'],
+            help="Number of pages [%default]")
+    parser.add_option('--depth', type="int", default=DEFAULTS['depth'],
+            help="Maximum directory depth of pages [%default]")
+    parser.add_option('--fanout', type="int", default=DEFAULTS['fanout'],
+            help="Directories per level [%default]")
+    parser.add_option('--body-size', type="int", dest="body_size",
+            default=DEFAULTS['body_size'],
+            help="Approximate page body size in bytes [%default]")
+    parser.add_option('--headers', type="int", default=DEFAULTS['headers'],
+            help="Extra headers per page [%default]")
+    parser.add_option('--code-blocks', type="float", dest="code_blocks",
+            default=DEFAULTS['code_blocks'],
+            help="Average code blocks per page, 0 disables codehilite "
+            "[%default]")
+    parser.add_option('--templates', type="int",
+            default=DEFAULTS['templates'],
+            help="Number of templates [%default]")
+    parser.add_option('--template-blocks', type="int",
+            dest="template_blocks", default=DEFAULTS['template_blocks'],
+            help="Loops and conditions per template [%default]")
+    parser.add_option('--seed', type="int", default=DEFAULTS['seed'],
+            help="Random seed [%default]")
+    return parser
+
+def generator_options(options):
+    """
+    the generator parameters from parsed options, as keyword arguments
+    """
+    return dict((key, getattr(options, key)) for key in DEFAULTS)
+
+def main():
+    parser = option_parser()
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected the directory of the new project")
+    generate(args[0], **generator_options(options))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+benchmarks/run
+--------------
+
+Times sr on a synthetic project (see generate.py) and writes the results as
+JSON, to be compared across commits with compare.py:
+
+    python benchmarks/run.py [options] results.json
+
+Scenarios, each run in a fresh sr process, never forwarded to a running sr
+daemon:
+
+    - cold: render with no output, manifest or caches
+    - noop: render again without any changes
+    - edit_page: render after changing a single page
+    - edit_template: render after changing the standard template
+    - list: list changed pages after changing a single page
+
+Every scenario is repeated --repeat times, the minimum and median wall clock
+times are reported.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+from generate import option_parser, generator_options, generate
+
+SR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sr')
+SR_SCRIPT = os.path.join(SR_DIR, 'sr.py')
+SCENARIOS = ('cold', 'noop', 'edit_page', 'edit_template', 'list')
+
+def run_sr(command, directory, jobs=1):
+    """
+    run an sr command and time it
+
+    @return: wall clock seconds
+    @rtype: float
+    """
+    args = [sys.executable, SR_SCRIPT, '--no-daemon', command, directory]
+    if command == 'render' and jobs > 1:
+        args[2:2] = ['--jobs', str(jobs)]
+    devnull = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        returncode = subprocess.call(args, stdout=devnull)
+        seconds = time.time() - start
+    finally:
+        devnull.close()
+    if returncode != 0:
+        raise RuntimeError("%s failed with status %d" %
+                           (' '.join(args), returncode))
+    return seconds
+
+def clean(directory):
+    """
+    remove everything a build leaves behind
+    """
+    for name in ('output', '.cache'):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+    os.makedirs(os.path.join(directory, 'output'))
+    for name in ('manifest.db', 'hash.db'):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.unlink(path)
+
+def first_page(directory):
+    """
+    path of the first page source in the project
+    """
+    for dirpath, dirnames, filenames in os.walk(os.path.join(directory,
+                                                             'source')):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            return os.path.join(dirpath, filename)
+
+def append(filename, text):
+    """
+    change a file and make sure its modification time changes as well
+    """
+    stat = os.stat(filename)
+    edited = open(filename, 'a')
+    edited.write(text)
+    edited.close()
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 1))
+
+def run_scenario(scenario, directory, counter, jobs=1):
+    """
+    prepare the project for a scenario and time it
+
+    @param counter: number of the run, used to make every edit different
+    @return: wall clock seconds
+    @rtype: float
+    """
+    if scenario == 'cold':
+        clean(directory)
+        return run_sr('render', directory, jobs)
+    # every other scenario starts from an up to date project
+    run_sr('render', directory, jobs)
+    if scenario == 'noop':
+        return run_sr('render', directory, jobs)
+    if scenario in ('edit_page', 'list'):
+        append(first_page(directory), '\nEdit number %d.\n' % counter)
+        if scenario == 'list':
+            return run_sr('list', directory)
+        return run_sr('render', directory, jobs)
+    if scenario == 'edit_template':
+        append(os.path.join(directory, 'templates', 'standard.html'),
+               '<!-- edit number %d -->\n' % counter)
+        return run_sr('render', directory, jobs)
+    raise ValueError("unknown scenario %s" % scenario)
+
+def git_revision():
+    """
+    the commit the benchmarked sr was checked out from, if known
+    """
+    try:
+        process = subprocess.Popen(
+            ['git', 'rev-parse', 'HEAD'], cwd=SR_DIR,
+            stdout=subprocess.PIPE, stderr=open(os.devnull, 'w')
+        )
+    except OSError:
+        return None
+    revision = process.communicate()[0].strip()
+    if process.returncode != 0:
+        return None
+    return revision
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def benchmark(directory, scenarios=SCENARIOS, repeat=3, jobs=1, out=None):
+    """
+    time all scenarios on a project
+
+    @param directory: project to benchmark, its outputs and caches are
+                      thrown away
+    @keyword scenarios: names of the scenarios to run
+    @keyword repeat: number of runs per scenario
+    @keyword jobs: worker processes for render
+    @keyword out: file to report progress to
+    @return: scenario names mapped to their timings
+    @rtype: dict
+    """
+    results = {}
+    for scenario in scenarios:
+        times = [run_scenario(scenario, directory, counter, jobs)
+                 for counter in range(repeat)]
+        results[scenario] = {
+            'times': times,
+            'min': min(times),
+            'median': median(times),
+        }
+        if out is not None:
+            print >> out, "%-14s min %8.3fs  median %8.3fs" % (
+                scenario, min(times), median(times)
+            )
+    return results
+
+def main():
+    parser = option_parser()
+    parser.set_usage("%prog [options] results.json")
+    parser.add_option('--repeat', type="int", default=3,
+            help="Runs per scenario [%default]")
+    parser.add_option('-j', '--jobs', type="int", default=1,
+            help="Worker processes for render [%default]")
+    parser.add_option('--scenario', action="append", dest="scenarios",
+            choices=SCENARIOS, metavar="NAME",
+            help="Scenario to run, may be given more than once "
+            "[all of %s]" % ', '.join(SCENARIOS))
+    parser.add_option('--project', default=None, metavar="DIR",
+            help="Benchmark an existing project instead of generating one, "
+            "its outputs and caches are thrown away")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected the file to write the results to")
+    parameters = generator_options(options)
+    generated = None
+    if options.project is None:
+        generated = tempfile.mkdtemp(prefix='sr-benchmark-')
+        directory = os.path.join(generated, 'project')
+        generate(directory, **parameters)
+    else:
+        directory = options.project
+        parameters = None
+    try:
+        results = benchmark(directory, options.scenarios or SCENARIOS,
+                            options.repeat, options.jobs, sys.stdout)
+    finally:
+        if generated is not None:
+            shutil.rmtree(generated)
+    results_file = open(args[0], 'w')
+    json.dump({
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'generator': parameters,
+        'repeat': options.repeat,
+        'jobs': options.jobs,
+        'scenarios': results,
+    }, results_file, indent=2, sort_keys=True)
+    results_file.write('\n')
+    results_file.close()
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import markdown
 # --------------- CONSTANTS YOU MIGHT WANT TO MODIFY -----------------
 
 DEFAULT_HILITER = 'pygments' # one of 'enscript', 'dp', or 'pygments'
+DEFAULT_CACHE_SIZE = 5000 # highlighted blocks kept in a cache file
+DEFAULT_PROCESSES = 4 # enscript processes run at once in batch mode
 try:
     TAB_LENGTH = markdown.TAB_LENGTH
 except AttributeError:
@@ -19,6 +21,15 @@ def escape(txt) :
     txt = txt.replace('"', '&quot;')
     return txt
 
+class Unhilited(unicode):
+    '''html of a block that is only escaped because the hiliter failed or isn't installed, it's never cached'''
+
+def unhilited(txt):
+    '''mark html as an escape-only fallback'''
+    if isinstance(txt, str):
+        txt = txt.decode('utf-8')
+    return Unhilited(txt)
+
 def number(txt):
     '''use <ol> for line numbering'''
     # Fix Whitespace
@@ -62,30 +73,103 @@ Usage:
         e = err.read()
         if e != 'output left in -\n' :
             # error - just escape
-            txt = escape(src)
+            return unhilited(_enscript_wrap(escape(src), num))
         else :
             import re
             pattern = re.compile(r'<PRE>(?P<code>.*?)</PRE>', re.DOTALL)
-            txt =  pattern.search(out.read()).group('code')
-            # fix enscripts output
-            txt = txt.replace('\n</FONT></I>', '</FONT></I>\n').strip()
-            html_map = {'<I>' : '<em>',
-                        '</I>' : '</em>',
-                        '<B>' : '<strong>',
-                        '</B>' : '</strong>',
-                        '<FONT COLOR="#' : '<span style="color:#',
-                        '</FONT>' : '</span>'
-                        }
-            for k, v in html_map.items() :
-                txt = txt.replace(k, v)
+            txt = _fix_enscript(pattern.search(out.read()).group('code'))
     else:
         txt = escape(src)
-    if num :
-        txt = number(txt)
-    else :
-        txt = '<div class="codehilite"><pre>%s</pre></div>\n'% txt
+    return _enscript_wrap(txt, num)
+
+def _fix_enscript(txt):
+    '''turn the contents of an enscript <PRE> block into our html'''
+    txt = txt.replace('\n</FONT></I>', '</FONT></I>\n').strip()
+    html_map = {'<I>' : '<em>',
+                '</I>' : '</em>',
+                '<B>' : '<strong>',
+                '</B>' : '</strong>',
+                '<FONT COLOR="#' : '<span style="color:#',
+                '</FONT>' : '</span>'
+                }
+    for k, v in html_map.items() :
+        txt = txt.replace(k, v)
     return txt
 
+def _enscript_wrap(txt, num):
+    if num :
+        return number(txt)
+    return '<div class="codehilite"><pre>%s</pre></div>\n'% txt
+
+def enscript_many(blocks, processes=DEFAULT_PROCESSES):
+    '''
+Highlight many code blocks with [enscript] (http://www.codento.com/people/mtr/genscript/), starting one enscript process per language instead of one per block. At most `processes` enscript processes run at the same time.
+
+Usage:
+    >>> enscript_many([(src, lang, num), ...] [, processes])
+
+      @param blocks: A list of (src, lang, num) tuples as taken by enscript().
+
+      @param processes: Maximum number of enscript processes running at once.
+
+      @returns : A list of html strings, in the order of blocks.
+
+Blocks of a language enscript fails on are escaped only, like enscript() does. If enscript's output can't be matched to the blocks, they are passed to enscript() one by one.
+    '''
+    import os, re, shutil, tempfile
+    from subprocess import Popen, PIPE
+    pattern = re.compile(r'<PRE>(?P<code>.*?)</PRE>', re.DOTALL)
+    results = [None] * len(blocks)
+    by_lang = {}
+    for index, (src, lang, num) in enumerate(blocks):
+        if lang:
+            by_lang.setdefault(lang, []).append(index)
+        else:
+            results[index] = _enscript_wrap(escape(src), num)
+    waiting = by_lang.items()
+    running = []
+    while waiting or running:
+        while waiting and len(running) < int(processes):
+            lang, indices = waiting.pop(0)
+            tmpdir = tempfile.mkdtemp()
+            filenames = []
+            for index in indices:
+                filename = os.path.join(tmpdir, '%d' % len(filenames))
+                src = blocks[index][0]
+                if isinstance(src, unicode):
+                    src = src.encode('utf-8')
+                f = open(filename, 'w')
+                f.write(src)
+                f.close()
+                filenames.append(filename)
+            cmd = ['enscript', '--highlight=%s' % lang, '--color',
+                   '--language=html', '--tabsize=%d' % TAB_LENGTH,
+                   '--output=-'] + filenames
+            try:
+                proc = Popen(cmd, stdout=PIPE, stderr=PIPE)
+            except OSError:
+                proc = None
+            running.append((proc, indices, tmpdir))
+        proc, indices, tmpdir = running.pop(0)
+        codes = []
+        if proc is not None:
+            out, err = proc.communicate()
+            if proc.returncode == 0:
+                codes = pattern.findall(out.decode('utf-8', 'replace'))
+        shutil.rmtree(tmpdir, True)
+        if proc is None or proc.returncode != 0:
+            # error - just escape
+            for index in indices:
+                src, lang, num = blocks[index]
+                results[index] = unhilited(_enscript_wrap(escape(src), num))
+        elif len(codes) != len(indices):
+            for index in indices:
+                results[index] = enscript(*blocks[index])
+        else:
+            for index, code in zip(indices, codes):
+                results[index] = _enscript_wrap(_fix_enscript(code), blocks[index][2])
+    return results
+
 
 def dp(src, lang=None, num=True):
     '''
@@ -138,7 +222,7 @@ Usage:
             txt = number(txt)
         else :
             txt = '<div class="codehilite"><pre>%s</pre></div>\n'% txt
-        return txt
+        return unhilited(txt)
     else:
         try:
             lexer = get_lexer_by_name(lang)
@@ -151,6 +235,136 @@ Usage:
         return highlight(src, lexer, formatter)
 
 
+# ------------------ The hilite cache ----------------------------------
+# versions by hiliter name, looked up once per process
+_versions = {}
+
+def hiliter_version(hiliter=DEFAULT_HILITER):
+    '''
+Describe the installed version of a hiliter, e.g. "pygments 2.5.2". Highlighted html depends on it, so it is part of cache keys. Missing hiliters are described as such, e.g. "pygments none", so installing them changes the keys as well.
+    '''
+    if hiliter not in _versions:
+        version = hiliter
+        if hiliter == 'pygments':
+            try:
+                import pygments
+            except ImportError:
+                version = 'pygments none'
+            else:
+                version = 'pygments %s' % getattr(pygments, '__version__', '')
+        elif hiliter == 'enscript':
+            import os
+            version = 'enscript none'
+            for directory in os.environ.get('PATH', '').split(os.pathsep):
+                filename = os.path.join(directory, 'enscript')
+                if os.path.isfile(filename):
+                    version = 'enscript %s %s' % (filename, os.stat(filename).st_mtime)
+                    break
+        _versions[hiliter] = version
+    return _versions[hiliter]
+
+class HiliteCache:
+    '''
+A persistent cache of highlighted html, stored in an SQLite file and shared by all pages, builds and processes using the same file. Blocks are keyed by source text, language, line numbering and hiliter, see hiliter_version(). When more than `size` blocks are stored, the least recently used ones are evicted. Blocks used in this process are also kept in memory, up to `size` of them as well.
+
+Usage:
+    >>> cache = HiliteCache('/tmp/hilite.db')
+    >>> key = cache.key(src, lang, linenos, hiliter_version('pygments'))
+    >>> html = cache.get(key)
+    >>> if html is None: cache.set(key, hilited_html)
+
+The cache is an optimization only: if the file can't be used, nothing is cached.
+    '''
+    def __init__(self, filename, size=DEFAULT_CACHE_SIZE):
+        import sqlite3
+        from collections import OrderedDict
+        self.error = sqlite3.Error
+        self.size = int(size)
+        self.memory = OrderedDict()
+        try:
+            self.db = sqlite3.connect(filename, timeout=30)
+            self.db.text_factory = str
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE IF NOT EXISTS blocks '
+                            '(key TEXT PRIMARY KEY, html TEXT, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS blocks_used '
+                            'ON blocks (used)')
+            self.db.commit()
+        except self.error:
+            self.db = None
+
+    def key(self, src, lang, linenos, hiliter):
+        '''Compute the key of a block from everything its html depends on'''
+        from md5 import md5
+        if isinstance(src, unicode):
+            src = src.encode('utf-8')
+        return md5('\0'.join([src, str(lang), str(bool(linenos)),
+                               hiliter])).hexdigest()
+
+    def get(self, key):
+        '''Return cached html for key or None, marking it as recently used'''
+        if key in self.memory:
+            html = self.memory.pop(key)
+            self.memory[key] = html
+            return html
+        if self.db is None:
+            return None
+        import time
+        try:
+            row = self.db.execute('SELECT html FROM blocks WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE blocks SET used = ? WHERE key = ?',
+                            (time.time(), key))
+            self.db.commit()
+        except self.error:
+            return None
+        html = row[0].decode('utf-8')
+        self._remember(key, html)
+        return html
+
+    def _remember(self, key, html):
+        '''Keep html in memory, forgetting the least recently used blocks'''
+        self.memory.pop(key, None)
+        self.memory[key] = html
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def set(self, key, html):
+        '''Store html for key, evicting the least recently used blocks'''
+        self._remember(key, html)
+        if self.db is None:
+            return
+        import time
+        if isinstance(html, unicode):
+            html = html.encode('utf-8')
+        try:
+            self.db.execute('INSERT OR REPLACE INTO blocks (key, html, used) '
+                            'VALUES (?, ?, ?)', (key, html, time.time()))
+            (count,) = self.db.execute('SELECT COUNT(*) FROM blocks').fetchone()
+            if count > self.size:
+                self.db.execute('DELETE FROM blocks WHERE key IN '
+                                '(SELECT key FROM blocks ORDER BY used LIMIT ?)',
+                                (count - self.size,))
+            self.db.commit()
+        except self.error:
+            pass
+
+# caches by process id and filename, so all pages rendered in a process share
+# one. SQLite connections can't be used across fork(), worker processes open
+# their own instead of the one inherited from their parent.
+_caches = {}
+
+def get_cache(filename, size=DEFAULT_CACHE_SIZE):
+    '''Return the HiliteCache for filename, opening it on first use in this process'''
+    import os
+    key = (os.getpid(), filename)
+    if key not in _caches:
+        _caches[key] = HiliteCache(filename, size)
+    return _caches[key]
+
+
 # ------------------ The Main CodeHilite Class ----------------------
 class CodeHilite:
     '''
@@ -168,6 +382,10 @@ Basic Usage:
       
       @param  hiliter:  A string. One of 'enscript', 'dp', or 'pygments'.
 
+      @param  cache:  A HiliteCache. Highlighted html is looked up there first (None by default).
+
+      @param  profile_hook:  Called as profile_hook('codehilite', start, seconds) after highlighting (None by default).
+
 Low Level Usage:
     >>> code = CodeHilite()
     >>> code.src = text                 # Can be a string or any object with a .readline attribute.
@@ -176,10 +394,13 @@ Low Level Usage:
     >>> code.hiliter = MyCustomHiliter  # Where MyCustomHiliter is callable, takes three arguments (src, lang, linenos) and returns a string.
     >>> html = code.hilite()
     '''
-    def __init__(self, src=None, lang=None, linenos = False, hiliter=DEFAULT_HILITER):
+    def __init__(self, src=None, lang=None, linenos = False, hiliter=DEFAULT_HILITER, cache=None, profile_hook=None):
         self.src = src
         self.lang = lang
         self.linenos = linenos
+        self.cache = cache
+        self.profile_hook = profile_hook
+        self.hiliter_name = hiliter
         # map of highlighters
         hl_map = { 'enscript' : enscript, 'dp' : dp, 'pygments' : pygment }
         try :
@@ -224,13 +445,80 @@ Determines language of a code block from shebang lines and whether said line sho
         
         self.src = "\n".join(lines).strip("\n")
 
-    def hilite(self):
-        '''The wrapper function which brings it all togeather'''
+    def _prepare(self):
+        '''Strip the source and determine language and line numbering'''
         self.src = self.src.strip('\n')
         
         if not self.lang : self._getLang()
+
+    def _cached(self):
+        '''Return cached html for this block or None'''
+        if self.cache is None:
+            return None
+        return self.cache.get(self.cache.key(self.src, self.lang, self.linenos, hiliter_version(self.hiliter_name)))
+
+    def _store(self, html):
+        '''Cache html for this block, unless it is an escape-only fallback'''
+        if self.cache is not None and not isinstance(html, Unhilited):
+            self.cache.set(self.cache.key(self.src, self.lang, self.linenos, hiliter_version(self.hiliter_name)), html)
+
+    def hilite(self):
+        '''The wrapper function which brings it all togeather'''
+        import time
+        start = time.time()
+        self._prepare()
         
-        return self.hiliter(self.src, self.lang, self.linenos)
+        html = self._cached()
+        if html is None:
+            html = self.hiliter(self.src, self.lang, self.linenos)
+            self._store(html)
+        if self.profile_hook is not None:
+            self.profile_hook('codehilite', start, time.time() - start)
+        return html
+
+
+# ------------------ Batch mode for enscript ------------------------
+class EnscriptBatch(markdown.TextPostprocessor):
+    '''
+Collects the code blocks of a document and highlights them all at once with enscript_many() when markdown has produced its output. Until then, each block is represented by a placeholder. If a markdown instance is given, its codehilite_fallback attribute is set when a block could only be escaped. A profile_hook is called like CodeHilite's, once per document.
+
+Usage:
+    >>> batch = EnscriptBatch(processes = 4)
+    >>> placeholder = batch.add(CodeHilite(src = text, hiliter = 'enscript'))
+    >>> html = batch.run(text_containing_placeholders)
+    '''
+    placeholder = u'\u0002codehilite:%d\u0003'
+
+    def __init__(self, processes=DEFAULT_PROCESSES, md=None, profile_hook=None):
+        self.processes = processes
+        self.md = md
+        self.profile_hook = profile_hook
+        self.blocks = []
+
+    def add(self, code):
+        '''Queue a CodeHilite block and return its placeholder'''
+        code._prepare()
+        self.blocks.append(code)
+        return self.placeholder % (len(self.blocks) - 1)
+
+    def run(self, text):
+        import time
+        start = time.time()
+        blocks, self.blocks = self.blocks, []
+        html = [code._cached() for code in blocks]
+        missing = [index for index, block_html in enumerate(html) if block_html is None]
+        hilited = enscript_many([(blocks[index].src, blocks[index].lang, blocks[index].linenos)
+                                 for index in missing], self.processes)
+        for index, block_html in zip(missing, hilited):
+            blocks[index]._store(block_html)
+            html[index] = block_html
+            if self.md is not None and isinstance(block_html, Unhilited):
+                self.md.codehilite_fallback = True
+        for index, block_html in enumerate(html):
+            text = text.replace(self.placeholder % index, block_html)
+        if self.profile_hook is not None and blocks:
+            self.profile_hook('codehilite', start, time.time() - start)
+        return text
 
 
 # ------------------ The Markdown Extention -------------------------------
@@ -238,7 +526,12 @@ class CodeHiliteExtention (markdown.Extension) :
     def __init__(self, configs):
         # define default configs
         self.config = {'hiliter' : [DEFAULT_HILITER, "one of 'enscript', 'dp', or 'pygments'"],
-                       'force_linenos' : [False, "Force line numbers - Default: False"] }
+                       'force_linenos' : [False, "Force line numbers - Default: False"],
+                       'cache' : [None, "File to cache highlighted blocks in - Default: None"],
+                       'cache_size' : [DEFAULT_CACHE_SIZE, "Number of blocks to keep in the cache - Default: %d" % DEFAULT_CACHE_SIZE],
+                       'batch' : [True, "Highlight all blocks of a page at once with enscript - Default: True"],
+                       'processes' : [DEFAULT_PROCESSES, "enscript processes running at once in batch mode - Default: %d" % DEFAULT_PROCESSES],
+                       'profile_hook' : [None, "Called as profile_hook('codehilite', start, seconds) after highlighting - Default: None"] }
         
         # Override defaults with user settings
         for key, value in configs :
@@ -246,6 +539,21 @@ class CodeHiliteExtention (markdown.Extension) :
             self.setConfig(key, value) 
             
     def extendMarkdown(self, md, md_globals) :
+        cache = None
+        if self.config['cache'][0]:
+            cache = get_cache(self.config['cache'][0], self.config['cache_size'][0])
+        batch = None
+        if self.config['hiliter'][0] == 'enscript' and \
+                str(self.config['batch'][0]).lower() in ('true', 'yes', 'on'):
+            batch = EnscriptBatch(self.config['processes'][0], md, self.config['profile_hook'][0])
+            md.textPostprocessors.append(batch)
+        self.batch = batch
+        # set when a block of the current document could only be escaped,
+        # its html shouldn't be cached
+        md.codehilite_fallback = False
+        self.md = md
+        # get reset along with markdown, see reset()
+        md.registerExtension(self)
   
         def _hiliteCodeBlock(parent_elem, lines, inList):
             """Overrides function of same name in standard Markdown class and
@@ -259,12 +567,24 @@ class CodeHiliteExtention (markdown.Extension) :
                @returns: None"""
             detabbed, theRest = md.blockGuru.detectTabbed(lines)
             text = "\n".join(detabbed).rstrip()+"\n"
-            code = CodeHilite(text, hiliter=self.config['hiliter'][0], linenos=self.config['force_linenos'][0]) 
-            placeholder = md.htmlStash.store(code.hilite())
+            code = CodeHilite(text, hiliter=self.config['hiliter'][0], linenos=self.config['force_linenos'][0], cache=cache, profile_hook=self.config['profile_hook'][0])
+            if batch is None:
+                html = code.hilite()
+                if isinstance(html, Unhilited):
+                    md.codehilite_fallback = True
+                placeholder = md.htmlStash.store(html)
+            else:
+                placeholder = md.htmlStash.store(batch.add(code))
             parent_elem.appendChild(md.doc.createTextNode(placeholder))
             md._processSection(parent_elem, theRest, inList)
             
         md._processCodeBlock = _hiliteCodeBlock
 
+    def reset(self) :
+        '''Drop blocks left over from a conversion that failed and forget about fallbacks'''
+        self.md.codehilite_fallback = False
+        if self.batch is not None:
+            self.batch.blocks = []
+
 def makeExtension(configs=None) :
   return CodeHiliteExtention(configs=configs)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+atomic
+------
+
+Replaces files atomically: data goes to a temporary file next to the target,
+which is renamed over it once complete. Readers, be it render workers, other
+builds or a web server, never see a partially written file, and an
+interrupted write leaves the old file alone.
+
+Temporary files are named after their target with a leading dot and a random
+part, e.g. ".page.html.3f2a91c0.tmp", so concurrent writers of the same file
+don't get in each other's way. They are created with the usual permissions,
+subject to the umask, like the file they replace would be.
+"""
+
+import os
+import errno
+
+def open_temporary(filename):
+    """
+    create a temporary file to replace a file with, along with any missing
+    directories
+
+    @param filename: file to be replaced
+    @type filename: string
+    @return: the temporary file opened for writing and its filename
+    @rtype: tuple
+    """
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another process meanwhile
+            if not os.path.isdir(directory):
+                raise
+    while True:
+        tmp_filename = os.path.join(directory, '.%s.%s.tmp' % (
+            os.path.basename(filename), os.urandom(4).encode('hex')
+        ))
+        try:
+            fd = os.open(tmp_filename,
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666)
+        except OSError, error:
+            if error.errno == errno.EEXIST:
+                continue
+            raise
+        return (os.fdopen(fd, 'wb'), tmp_filename)
+
+def write_atomically(filename, data):
+    """
+    replace a file's contents
+
+    @param filename: file to replace, missing directories are created
+    @type filename: string
+    @param data: new contents
+    @type data: string
+    """
+    tmp_file, tmp_filename = open_temporary(filename)
+    try:
+        try:
+            tmp_file.write(data)
+        finally:
+            tmp_file.close()
+        os.rename(tmp_filename, filename)
+    except:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        raise
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+cache
+-----
+
+Content addressed caches stored inside the project directory. Values are
+looked up by a hash of everything they were computed from, so entries never
+go stale: changed input simply leads to a different key. Values for inputs
+that are gone pile up though, `ContentCache.evict` removes those that haven't
+been used for a while. The .cache directory can also be deleted at any time,
+whatever is needed is computed again.
+"""
+
+import os
+import time
+from md5 import md5
+
+from atomic import write_atomically
+
+def make_key(*parts):
+    """
+    compute a cache key from strings
+
+    @param parts: everything the cached value depends on
+    @type parts: strings, unicode is encoded as utf-8
+    @return: hex digest usable as a key
+    @rtype: string
+    """
+    key = md5()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        key.update(part)
+        key.update('\0')
+    return key.hexdigest()
+
+class ContentCache(object):
+    """
+    unicode strings stored as files under a directory, one file per key
+    """
+    def __init__(self, directory):
+        """
+        @param directory: where to store the cached values, created when
+                          the first value is stored
+        @type directory: string
+        """
+        self.directory = directory
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        look up a cached value
+
+        @param key: key as returned by `make_key`
+        @type key: string
+        @return: the cached value, None if there is none
+        @rtype: unicode
+        """
+        filename = self._filename(key)
+        try:
+            cache_file = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            value = cache_file.read().decode('utf-8')
+        finally:
+            cache_file.close()
+        try:
+            # marks the value as used, see `evict`
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        """
+        store a value
+
+        the value is written to a temporary file and renamed into place, so
+        concurrent readers, e.g. render workers, never see a partial value.
+        Failing to store a value isn't an error, it just won't be cached.
+
+        @param key: key as returned by `make_key`
+        @type key: string
+        @param value: value to store
+        @type value: unicode
+        """
+        try:
+            write_atomically(self._filename(key), value.encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+    def evict(self, max_age):
+        """
+        remove values that haven't been stored or looked up for a while
+
+        @param max_age: seconds since a value was last used
+        @type max_age: int
+        @return: number of values removed
+        @rtype: int
+        """
+        if not os.path.isdir(self.directory):
+            return 0
+        oldest = time.time() - max_age
+        evicted = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                filename = os.path.join(dirpath, filename)
+                try:
+                    if os.stat(filename).st_mtime < oldest:
+                        os.unlink(filename)
+                        evicted += 1
+                except OSError:
+                    # removed by another process meanwhile
+                    pass
+        return evicted
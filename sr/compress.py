@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+compress
+--------
+
+Writes pre-compressed siblings of output files, e.g. page.html.gz next to
+page.html, for web servers serving them directly (nginx' gzip_static and
+brotli_static). Enabled per project in config.ini:
+
+    [general]
+    compress = gzip, brotli
+
+brotli needs the brotli module and is skipped if it isn't installed.
+Compression runs in a few threads while rendering goes on, zlib and brotli
+don't hold the interpreter lock while compressing.
+"""
+
+import os
+import gzip
+import time
+import threading
+from Queue import Queue
+from cStringIO import StringIO
+
+from atomic import write_atomically
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_THREADS = 4
+
+def gzip_compress(data):
+    """
+    gzip data reproducibly, without a timestamp or filename in the header
+    """
+    buffer = StringIO()
+    gzip_file = gzip.GzipFile(filename='', mode='wb', compresslevel=9,
+                              fileobj=buffer, mtime=0)
+    try:
+        gzip_file.write(data)
+    finally:
+        gzip_file.close()
+    return buffer.getvalue()
+
+def brotli_compress(data):
+    return brotli.compress(data)
+
+# format names mapped to the suffix of their files and a function
+# compressing a string
+FORMATS = {
+    'gzip': ('.gz', gzip_compress),
+    'brotli': ('.br', brotli_compress),
+}
+
+def available(name):
+    """
+    check if a compression format can be used here
+    """
+    return name == 'gzip' or (name == 'brotli' and brotli is not None)
+
+def sibling_filenames(filename):
+    """
+    compressed siblings a file may have in any of the known formats
+
+    @rtype: list of strings
+    """
+    return [filename + suffix for suffix, compress in FORMATS.itervalues()]
+
+class Compressor(object):
+    """
+    compresses files in background threads
+    """
+    def __init__(self, formats, threads=DEFAULT_THREADS, timer=None):
+        """
+        @param formats: names of the formats to write, those not available
+                        here are left out
+        @type formats: list of strings
+        @keyword threads: number of compressing threads, started with the
+                          first file
+        @keyword timer: records the time taken per file as "compress"
+        @type timer: Timer object from timing
+        """
+        for name in formats:
+            if name not in FORMATS:
+                raise ValueError("unknown compression format %s" % name)
+        self.formats = [name for name in formats if available(name)]
+        self.threads = threads
+        self.timer = timer
+        self._queue = None
+        self._errors = []
+
+    def submit(self, filename, page_name=None, only_missing=False):
+        """
+        have the compressed siblings of a file written
+
+        siblings existing from before are removed right away, so they
+        never are out of date, even if compression doesn't get to finish.
+        Siblings in formats that aren't written any more are removed as
+        well, a web server would serve them in place of the file.
+
+        @param filename: file to compress
+        @type filename: string
+        @keyword page_name: page the file belongs to, for the timer
+        @keyword only_missing: keep siblings that exist and write only the
+                               missing ones, for files that didn't change
+        """
+        for name, (suffix, compress) in FORMATS.iteritems():
+            if name not in self.formats and os.path.exists(filename + suffix):
+                os.unlink(filename + suffix)
+        if not self.formats:
+            return
+        targets = []
+        for name in self.formats:
+            suffix, compress = FORMATS[name]
+            target = filename + suffix
+            if only_missing and os.path.exists(target):
+                continue
+            if os.path.exists(target):
+                os.unlink(target)
+            targets.append((target, compress))
+        if not targets:
+            return
+        if self._queue is None:
+            self._start()
+        self._queue.put((filename, page_name, targets))
+
+    def wait(self, raise_errors=True):
+        """
+        wait until everything submitted has been compressed
+
+        raises the first error a compressing thread ran into, errors are
+        forgotten either way
+
+        @keyword raise_errors: raise errors, don't when already handling
+                               another one
+        """
+        if self._queue is not None:
+            self._queue.join()
+        errors, self._errors = self._errors, []
+        if errors and raise_errors:
+            raise errors[0]
+
+    def _start(self):
+        self._queue = Queue()
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._work)
+            thread.setDaemon(True)
+            thread.start()
+
+    def _work(self):
+        while True:
+            filename, page_name, targets = self._queue.get()
+            try:
+                try:
+                    start = time.time()
+                    source_file = open(filename, 'rb')
+                    try:
+                        data = source_file.read()
+                    finally:
+                        source_file.close()
+                    for target, compress in targets:
+                        write_atomically(target, compress(data))
+                    if self.timer is not None:
+                        self.timer.add('compress', start,
+                                       time.time() - start, page=page_name)
+                except Exception, error:
+                    self._errors.append(error)
+            finally:
+                self._queue.task_done()
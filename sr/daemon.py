@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+daemon
+------
+
+Keeps projects loaded between builds. `sr serve-daemon` listens on a Unix
+socket for render, list and prune requests, which the sr command line
+forwards while it is running. Builds then skip interpreter startup, importing
+markdown and pygments, reading the config and compiling templates.
+
+A request is a single JSON object with the command, the absolute project
+directory and the command line options; the client shuts down its side of
+the connection after sending it. The daemon answers with the exit status and
+whatever the command printed, and handles one request at a time.
+
+Only sockets created by the user running sr are used, and the default one is
+placed where other users can't get at it: in $XDG_RUNTIME_DIR, or else in a
+directory only the user may access inside the temporary directory.
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import socket
+import traceback
+from md5 import md5
+from optparse import Values
+from StringIO import StringIO
+
+from pathfilter import PathFilter
+
+def default_socket_path():
+    """
+    where the daemon listens unless told otherwise, one per user
+
+    can be set with the SR_DAEMON_SOCKET environment variable. Otherwise
+    the socket is put into the user's private runtime directory, or into a
+    directory only the user may access inside the temporary directory. That
+    one is looked up without tempfile, importing it would cost every build
+    more than forwarding saves on small projects
+    """
+    if os.environ.get('SR_DAEMON_SOCKET'):
+        return os.environ['SR_DAEMON_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'sr-daemon.sock')
+    return _tmp_socket_path()
+
+def _tmp_socket_path():
+    return os.path.join(os.environ.get('TMPDIR') or '/tmp',
+                        'sr-daemon-%d' % os.getuid(), 'daemon.sock')
+
+def is_own_socket(socket_path):
+    """
+    check if a path is a socket created by the current user, whoever else
+    may have created it can't be trusted with requests
+
+    @rtype: bool
+    """
+    try:
+        socket_stat = os.lstat(socket_path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(socket_stat.st_mode) and \
+        socket_stat.st_uid == os.getuid()
+
+def _private_directory(directory):
+    """
+    create a directory only the current user may access, or make sure an
+    existing one is such a directory
+
+    exits if it's another user's or others may access it
+    """
+    try:
+        os.mkdir(directory, 0700)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    directory_stat = os.lstat(directory)
+    if not stat.S_ISDIR(directory_stat.st_mode) or \
+            directory_stat.st_uid != os.getuid() or \
+            directory_stat.st_mode & 077:
+        sys.exit("Error: %s has to be a directory only you can access" %
+                 directory)
+
+def manifest_stat(directory):
+    """
+    stat data of a project's manifest, None if there is none
+
+    @param directory: path to the project directory
+    @type directory: string
+    @rtype: tuple
+    """
+    try:
+        stat = os.stat(os.path.join(directory, 'manifest.db'))
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+
+def _receive(connection):
+    """
+    read from a connection until the other side shuts it down
+    """
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return ''.join(chunks)
+
+def request(command, directory, options, socket_path=None):
+    """
+    have a running daemon execute a command
+
+    @param command: "render", "list" or "prune"
+    @type command: string
+    @param directory: path to the project directory
+    @type directory: string
+    @param options: command line options as a dictionary
+    @type options: dict
+    @keyword socket_path: socket the daemon listens on
+    @return: exit status and output of the command, None if no daemon of
+             the current user is running
+    @rtype: tuple
+    """
+    socket_path = socket_path or default_socket_path()
+    if not is_own_socket(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(socket_path)
+        except socket.error:
+            # left behind by a daemon that didn't shut down cleanly
+            return None
+        client.sendall(json.dumps({
+            'command': command,
+            'directory': os.path.abspath(directory),
+            'options': options,
+        }))
+        client.shutdown(socket.SHUT_WR)
+        response = _receive(client)
+    finally:
+        client.close()
+    try:
+        response = json.loads(response)
+    except ValueError:
+        return (1, u"Error: the sr daemon didn't answer, it may have "
+                   u"stopped during the build\n")
+    return (response['status'], response['output'])
+
+class Daemon(object):
+    """
+    serve render, list and prune requests for any number of projects, keeping
+    each project loaded after its first request
+    """
+    def __init__(self, handler, socket_path=None, out=sys.stdout):
+        """
+        @param handler: called with the command, the project and the
+                        options of each request, prints the command's output
+        @type handler: callable
+        @keyword socket_path: socket to listen on
+        @keyword out: where to log requests
+        """
+        self.handler = handler
+        self.socket_path = socket_path or default_socket_path()
+        self.out = out
+        self.projects = {}
+        # stat data of each loaded project's manifest as the daemon left it
+        self.manifest_stats = {}
+
+    def project(self, directory):
+        """
+        the loaded project in a directory
+
+        the project is loaded again when its config has changed, or its
+        manifest has been changed, replaced or removed by anything else
+
+        @param directory: absolute path to the project directory
+        @type directory: string
+        @rtype: Project object from libsr
+        """
+        # imported here rather than at the top, sending a request
+        # shouldn't pay for loading markdown
+        from libsr import Project
+        directory = os.path.realpath(directory)
+        project = self.projects.get(directory)
+        if project is not None:
+            try:
+                config_file = open(os.path.join(directory, 'config.ini'))
+                try:
+                    config_hash = md5(config_file.read()).hexdigest()
+                finally:
+                    config_file.close()
+            except IOError:
+                config_hash = None
+            if config_hash != project.config_hash or \
+                    manifest_stat(directory) != \
+                    self.manifest_stats.get(directory):
+                self.unload(directory)
+                project = None
+        if project is None:
+            project = Project(directory)
+            self.projects[directory] = project
+        return project
+
+    def unload(self, directory):
+        """
+        forget a loaded project
+        """
+        project = self.projects.pop(directory, None)
+        self.manifest_stats.pop(directory, None)
+        if project is not None:
+            project.manifest.close()
+
+    def handle(self, connection):
+        """
+        execute a single request and send back its output
+        """
+        started = time.time()
+        try:
+            request = json.loads(_receive(connection))
+        except ValueError:
+            # e.g. another daemon checking whether this one is running
+            return
+        # paths are byte strings everywhere else, templates can't even be
+        # compiled from a unicode filename
+        directory = os.path.realpath(request['directory'].encode(
+            sys.getfilesystemencoding() or 'utf-8'
+        ))
+        options = Values(request['options'])
+        output = StringIO()
+        status = 0
+        stdout = sys.stdout
+        sys.stdout = output
+        try:
+            try:
+                project = self.project(directory)
+                project.paranoid = options.paranoid
+                project.path_filter = PathFilter(options.only,
+                                                 options.exclude)
+                self.handler(request['command'], project, options)
+            except SystemExit, exit:
+                status = 1
+                if exit.code:
+                    print exit.code
+            except Exception:
+                status = 1
+                traceback.print_exc(file=output)
+                # whatever state the project was left in, start over
+                self.unload(directory)
+        finally:
+            sys.stdout = stdout
+        if directory in self.projects:
+            self.manifest_stats[directory] = manifest_stat(directory)
+        try:
+            connection.sendall(json.dumps({
+                'status': status,
+                'output': output.getvalue(),
+            }))
+        except socket.error:
+            # the client went away
+            pass
+        print >> self.out, "%s %s: %s (%.3fs)" % (
+            request['command'], directory, status and 'failed' or 'done',
+            time.time() - started
+        )
+
+    def serve(self):
+        """
+        answer requests until interrupted
+        """
+        if self.socket_path == _tmp_socket_path():
+            _private_directory(os.path.dirname(self.socket_path))
+        if os.path.lexists(self.socket_path) and \
+                not is_own_socket(self.socket_path):
+            sys.exit("Error: %s exists and isn't a socket of yours" %
+                     self.socket_path)
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(self.socket_path)
+                    listening = True
+                except socket.error:
+                    listening = False
+            finally:
+                probe.close()
+            if listening:
+                sys.exit("Error: an sr daemon is already listening on %s" %
+                         self.socket_path)
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user running the daemon may connect
+        umask = os.umask(0077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        server.listen(5)
+        print >> self.out, "sr daemon listening on %s" % self.socket_path
+        try:
+            while True:
+                connection, address = server.accept()
+                try:
+                    self.handle(connection)
+                finally:
+                    connection.close()
+        finally:
+            server.close()
+            os.unlink(self.socket_path)
+            for directory in self.projects.keys():
+                self.unload(directory)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+frontmatter
+-----------
+
+Pages start with a header of "Key: value" lines, separated from the body by
+an empty line. This splits them the way the email package used to, without
+building and re-serializing a message object:
+
+    - header keys are printable characters except spaces and colons
+    - lines starting with whitespace continue the previous header
+    - the first line that is no header starts the body, even without an
+      empty line in between
+    - keys are matched case insensitively, the first header with a key wins
+
+Unlike the email package, a first line starting with "From " is kept rather
+than dropped as an mbox separator.
+"""
+
+import re
+
+header_re = re.compile(r'([\041-\071\073-\176]+):\s*(.*)$')
+
+def parse(data):
+    """
+    split a page's source into header and body
+
+    @param data: page source
+    @type data: string
+    @return: headers as (key, value) pairs in order of appearance and body
+    @rtype: tuple
+    """
+    headers = []
+    pos = 0
+    length = len(data)
+    while pos < length:
+        end = data.find('\n', pos)
+        if end < 0:
+            end = length
+        else:
+            end += 1
+        line = data[pos:end].rstrip('\r\n')
+        if not line:
+            # empty line between header and body
+            pos = end
+            break
+        if line[0] in ' \t':
+            # a continuation without a header to continue is dropped
+            if headers:
+                key, value = headers[-1]
+                headers[-1] = (key, value + '\n' + line)
+        else:
+            match = header_re.match(line)
+            if match is None:
+                break
+            headers.append(match.groups())
+        pos = end
+    return (headers, data[pos:])
+
+def get_header(headers, key, default=None):
+    """
+    look up a header case insensitively
+
+    @param headers: (key, value) pairs as returned by `parse`
+    @type headers: list of tuples
+    @param key: header to look up
+    @type key: string
+    @return: value of the first header with that key
+    """
+    key = key.lower()
+    for header_key, value in headers:
+        if header_key.lower() == key:
+            return value
+    return default
+
+def header_dict(headers):
+    """
+    headers as a dictionary, e.g. for a template context
+
+    every key is kept as written, each mapped to the value of the first
+    header with that key in any case
+
+    @param headers: (key, value) pairs as returned by `parse`
+    @type headers: list of tuples
+    @rtype: dict
+    """
+    result = {}
+    first_values = {}
+    for key, value in headers:
+        first_values.setdefault(key.lower(), value)
+    for key, value in headers:
+        result[key] = first_values[key.lower()]
+    return result
@@ -12,32 +12,250 @@ This is the part of sr that distinguishes directories into projects
 """
 
 import os
+import re
 import sys
-import codecs
-import shelve
+import time
+import fnmatch
+from multiprocessing import Pool
+from collections import deque
 from ConfigParser import SafeConfigParser
-from email import message_from_string
 from md5 import md5
 sys.path.append(os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     'MarkdownAddons',
     )
 )
-from markdown import markdown
+import markdown
+from markdown import Markdown
+import mdx_codehilite
 
+import frontmatter
 import templates
+from cache import ContentCache, make_key
+from manifest import Manifest
+from timing import NullTimer, Timer
+from pathfilter import PathFilter
+from compress import Compressor, sibling_filenames
+from atomic import open_temporary
+
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+# part of the markdown cache key, a new markdown version may render
+# differently
+MARKDOWN_VERSION = getattr(markdown, 'version', '')
+
+# cached markdown conversions not used for this long are removed by prune
+MARKDOWN_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# files and directories modified this recently might change again within
+# the same mtime tick. Their modification times aren't trusted to tell
+# whether they changed, nor are directory listings put into the index.
+RACY_SECONDS = 2
+
+# project used by render worker processes, see _init_worker
+_worker_project = None
+
+def _init_worker(directory, profile, refresh_caches):
+    """
+    set up a render worker process with its own copy of the project
+
+    @param directory: path to the project directory
+    @type directory: string
+    @param profile: collect timings to send back with each page
+    @type profile: bool
+    @param refresh_caches: convert markdown again instead of using cached
+                           output, see `Project.refresh_caches`
+    @type refresh_caches: bool
+    """
+    global _worker_project
+    timer = None
+    if profile:
+        timer = Timer()
+    _worker_project = Project(directory, use_manifest=False, timer=timer)
+    _worker_project.refresh_caches = refresh_caches
+
+def _render_worker(task):
+    """
+    render a single page inside a worker process
+
+    @param task: page to render and the hash of its current output file
+    @type task: tuple
+    @return: page name, its template name, what `Page.write_output`
+             returns, the stat data of the source file taken before it was
+             read and timings recorded while rendering
+    @rtype: tuple
+    """
+    page_name, old_output_hash = task
+    page = Page(_worker_project, page_name)
+    timer = _worker_project.timer
+    with timer.timed('page', page=page_name):
+        page_hash, output_hash, written = page.write_output(old_output_hash)
+    return (page_name, page.template_name, page_hash, output_hash, written,
+            page.stat, timer.drain())
+
+def is_racy(mtime):
+    """
+    check if a modification time is too recent to be sure that a later
+    change would change it, on filesystems with coarse timestamps
+
+    @param mtime: modification time of a file or directory
+    @type mtime: float
+    @rtype: bool
+    """
+    return time.time() - mtime <= RACY_SECONDS
+
+def trusted_stat(stat):
+    """
+    stat data of a page source to remember, without a racy modification
+    time. Pages whose recorded modification time is missing are hashed when
+    checked for changes.
+
+    @param stat: modification time, size and inode, see `Page.stat`
+    @type stat: dict
+    @rtype: dict
+    """
+    if is_racy(stat['mtime']):
+        stat = dict(stat, mtime=None)
+    return stat
+
+def list_directory(path):
+    """
+    list a directory, telling files from subdirectories
+
+    with the scandir module installed, entries know their type without a
+    stat call each on most filesystems. Like os.walk, symlinks to
+    directories are neither files nor descended into.
+
+    @param path: directory to list
+    @type path: string
+    @return: sorted names of files and of subdirectories
+    @rtype: tuple of lists
+    """
+    files = []
+    subdirectories = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirectories.append(entry.name)
+            else:
+                files.append(entry.name)
+    else:
+        for name in os.listdir(path):
+            filename = os.path.join(path, name)
+            if os.path.isdir(filename):
+                if not os.path.islink(filename):
+                    subdirectories.append(name)
+            else:
+                files.append(name)
+    files.sort()
+    subdirectories.sort()
+    return (files, subdirectories)
+
+class OutputFile(object):
+    """
+    file like object replacing a file's contents atomically
+
+    what is written goes to a temporary file next to the target, see
+    atomic, which is renamed over it by `commit`. The data is hashed on the
+    way, so it can still be thrown away with `discard` if it turns out to be
+    unchanged.
+    Small outputs are kept in memory until then and the temporary file is
+    only created once more than `spool_size` bytes have been written.
+    """
+    spool_size = 1024 * 1024
+
+    def __init__(self, filename):
+        """
+        @param filename: file to replace, missing directories are created
+        @type filename: string
+        """
+        self.filename = filename
+        self.tmp_filename = None
+        self._md5 = md5()
+        self._chunks = []
+        self._size = 0
+        self._file = None
+
+    def write(self, data):
+        self._md5.update(data)
+        if self._file is None:
+            self._chunks.append(data)
+            self._size += len(data)
+            if self._size > self.spool_size:
+                self._spool()
+        else:
+            self._file.write(data)
+
+    def hexdigest(self):
+        """
+        md5 hash of everything written so far
+        """
+        return self._md5.hexdigest()
+
+    def _spool(self):
+        """
+        create the temporary file and move what has been written into it
+        """
+        self._file, self.tmp_filename = open_temporary(self.filename)
+        try:
+            self._file.write(''.join(self._chunks))
+        except:
+            self.discard()
+            raise
+        self._chunks = []
+        self._size = 0
+
+    def commit(self):
+        """
+        replace the file with what has been written
+        """
+        try:
+            if self._file is None:
+                self._spool()
+            self._file.close()
+            os.rename(self.tmp_filename, self.filename)
+        except:
+            self.discard()
+            raise
+        self._file = None
+
+    def discard(self):
+        """
+        leave the file as it is, can be called more than once
+        """
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            if os.path.exists(self.tmp_filename):
+                os.unlink(self.tmp_filename)
 
 class Project(object):
     """
     base project where all pages are stored inside. MD5Sums of pages are 
-    stored in a hash db inside a shelve
+    stored in the project's manifest
     """
-    def __init__(self, directory):
+    # changed pages handed to the render workers at once in parallel builds
+    render_batch_size = 32
+
+    def __init__(self, directory, use_manifest=True, paranoid=False,
+                 timer=None, path_filter=None):
         """
-        open the config file and hash db
+        open the config file and manifest
 
         @param directory: path to the directory the project is olocated in
         @type directory: string
+        @keyword use_manifest: open the manifest. Render workers don't need it
+        @keyword paranoid: always hash pages to find out if they changed, even
+                           if their size and modification time didn't
+        @keyword timer: record how long the phases of builds take
+        @type timer: Timer object from timing
+        @keyword path_filter: restrict builds to some pages
+        @type path_filter: PathFilter object from pathfilter
         """
 
         self.directory = os.path.abspath(directory)
@@ -53,11 +271,67 @@ class Project(object):
         config_file.seek(0)
         self.config.readfp(config_file)
         self.source_dir = os.path.join(self.directory, 'source')
+        self.template_dir = os.path.join(self.directory, 'templates')
         self.page_suffix = self.config.get('general', 'suffix')
-        self.hash_db = shelve.open(
-            os.path.join(self.directory, 'hash.db'),
-            writeback=True
+        # names of source files and directories to skip, new projects skip
+        # hidden ones like .git, editor backups and lock files
+        ignore = ''
+        if self.config.has_option('general', 'ignore'):
+            ignore = self.config.get('general', 'ignore')
+        self.ignore_patterns = [pattern.strip() for pattern in
+                                ignore.split(',') if pattern.strip()]
+        self._ignore_re = re.compile('|'.join(
+            [fnmatch.translate(pattern) for pattern in self.ignore_patterns]
+        ) or '(?!)')
+        self.paranoid = paranoid
+        if path_filter is None:
+            path_filter = PathFilter()
+        self.path_filter = path_filter
+        if timer is None:
+            timer = NullTimer()
+        self.timer = timer
+        compress_formats = []
+        if self.config.has_option('general', 'compress'):
+            compress_formats = [
+                name.strip() for name in
+                self.config.get('general', 'compress').split(',')
+                if name.strip()
+            ]
+        try:
+            self.compressor = Compressor(compress_formats, timer=self.timer)
+        except ValueError, error:
+            sys.exit("Error: %s in config.ini" % error)
+        self.template_cache = templates.TemplateCache(
+            os.path.join(self.directory, '.cache', 'templates')
         )
+        self._template_hashes = {}
+        # output files left alone during the last build, their contents
+        # didn't change
+        self.writes_skipped = 0
+        # pages removed by the last build, their source files were gone
+        self.pages_pruned = []
+        self.safe_mode = self.config.get('markdown', 'safe').lower() in [
+                                                               "true",
+                                                               "yes",
+                                                               "on"]
+        self.markdown_addons = [addon for addon in
+                self.config.get('markdown', 'addons').split(',')
+                  if addon]
+        self._markdown = None
+        self._markdown_key = None
+        self.markdown_cache = ContentCache(
+            os.path.join(self.directory, '.cache', 'markdown')
+        )
+        # convert markdown again and replace cached output rather than use
+        # it, set during forced builds
+        self.refresh_caches = False
+        if use_manifest:
+            self.manifest = Manifest(
+                os.path.join(self.directory, 'manifest.db'),
+                legacy_filename=os.path.join(self.directory, 'hash.db'),
+            )
+        else:
+            self.manifest = None
 
     @property
     def pages(self):
@@ -66,78 +340,525 @@ class Project(object):
         
         output is relative to project's source directory,
         contains all filenames that carry the suffix supplied in conig.ini,
-        sans leading slash and filename suffix
+        sans leading slash and filename suffix. Files and directories
+        matching the ignore patterns are skipped, so are those the path
+        filter rules out.
+
+        directories whose modification time is the one recorded in the
+        directory index aren't listed again, unless the project is paranoid
        """
-        for directory in os.walk(self.source_dir):
-            for filename in directory[2]: 
-                if filename.endswith(self.page_suffix):
-                    page_name = os.path.join(
-                        directory[0].partition('source')[2],
-                        filename
-                    )\
-                    [0:-1 * len(self.page_suffix)]\
-                    .lstrip('/')
-                    yield Page(self, page_name)
+        index = {}
+        if self.manifest is not None and not self.paranoid:
+            index = self.manifest.directories()
+        pending = ['']
+        while pending:
+            with self.timer.timed('discovery'):
+                directory = pending.pop()
+                filenames, subdirectories = self._list_source_dir(directory,
+                                                                  index)
+                page_names = []
+                for filename in filenames:
+                    if filename.endswith(self.page_suffix) and \
+                            not self.ignored(filename):
+                        filename = os.path.join(directory, filename)
+                        page_name = filename[0:-1 * len(self.page_suffix)]
+                        if self.path_filter.matches(filename, page_name):
+                            page_names.append(page_name)
+                # reversed, so directories are walked in order
+                for subdirectory in reversed(subdirectories):
+                    subdirectory = os.path.join(directory, subdirectory)
+                    if not self.ignored(os.path.basename(subdirectory)) and \
+                            self.path_filter.descend(subdirectory):
+                        pending.append(subdirectory)
+            for page_name in page_names:
+                yield Page(self, page_name)
+
+    def _list_source_dir(self, directory, index):
+        """
+        list a source directory, from the directory index if it hasn't been
+        modified since
+
+        @param directory: directory relative to the source directory
+        @type directory: string
+        @param index: the directory index as read from the manifest
+        @type index: dict
+        @return: names of files and of subdirectories
+        @rtype: tuple of lists
+        """
+        path = os.path.join(self.source_dir, directory)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # vanished meanwhile, os.walk ignores these as well
+            return ([], [])
+        entry = index.get(directory)
+        if entry is not None and entry[0] == mtime:
+            return entry[1:]
+        try:
+            filenames, subdirectories = list_directory(path)
+        except OSError:
+            return ([], [])
+        if self.manifest is not None:
+            if entry is not None:
+                for removed in set(entry[2]) - set(subdirectories):
+                    self.manifest.remove_directory(
+                        os.path.join(directory, removed)
+                    )
+            if not is_racy(mtime):
+                self.manifest.update_directory(directory, mtime, filenames,
+                                               subdirectories)
+        return (filenames, subdirectories)
+
+    def ignored(self, name):
+        """
+        check if a file or directory name matches an ignore pattern
+        """
+        return self._ignore_re.match(name) is not None
+
+    @property
+    def markdown(self):
+        """
+        markdown converter with the project's safe mode and addons, set up
+        once and shared by all pages
+
+        addons may carry settings like in markdown's own `markdown()`
+        function, e.g. "codehilite(force_linenos=True)". Unless configured
+        otherwise, codehilite caches highlighted code in the project.
+        """
+        if self._markdown is None:
+            extensions, extension_configs = self._markdown_extensions()
+            if 'codehilite' in extensions:
+                codehilite_configs = extension_configs.setdefault(
+                    'codehilite', []
+                )
+                if 'cache' not in dict(codehilite_configs):
+                    cache_dir = os.path.join(self.directory, '.cache')
+                    if not os.path.isdir(cache_dir):
+                        os.makedirs(cache_dir)
+                    codehilite_configs.append(
+                        ('cache', os.path.join(cache_dir, 'codehilite.db'))
+                    )
+                if self.timer.enabled:
+                    # highlighting is timed for this project only
+                    codehilite_configs.append(('profile_hook', self.timer.add))
+            self._markdown = Markdown(
+                extensions=extensions,
+                extension_configs=extension_configs,
+                safe_mode=self.safe_mode,
+            )
+        return self._markdown
+
+    def _markdown_extensions(self):
+        """
+        parse the configured addons
+
+        @return: extension names and their settings by name
+        @rtype: tuple of a list and a dict
+        """
+        extensions = []
+        extension_configs = {}
+        for addon in self.markdown_addons:
+            name, paren, settings = addon.partition('(')
+            extensions.append(name)
+            if paren:
+                extension_configs[name] = [
+                    tuple(part.strip() for part in setting.split('='))
+                    for setting in settings.rstrip(')').split(',')
+                ]
+        return (extensions, extension_configs)
 
     @property
-    def config_changed(self):
+    def markdown_key(self):
+        """
+        the part of markdown cache keys standing for everything besides
+        the page body that the html depends on: safe mode, addons and the
+        versions of markdown and of the highlighter used by codehilite
+        """
+        if self._markdown_key is None:
+            extensions, extension_configs = self._markdown_extensions()
+            parts = [
+                str(self.safe_mode),
+                ','.join(self.markdown_addons),
+                MARKDOWN_VERSION,
+            ]
+            if 'codehilite' in extensions:
+                hiliter = dict(extension_configs.get('codehilite', [])).get(
+                    'hiliter', mdx_codehilite.DEFAULT_HILITER
+                )
+                parts.append(mdx_codehilite.hiliter_version(hiliter))
+            self._markdown_key = make_key(*parts)
+        return self._markdown_key
+
+    def template_hash(self, template_name):
+        """
+        current md5 hash of a template
+
+        the hash is remembered in the manifest along with the template's
+        stat data, templates are only hashed again if that changes or the
+        project is paranoid. Within a build, each template is looked at once.
+
+        @param template_name: template filename relative to the templates
+                              directory
+        @type template_name: string
+        @return: hash of the template, None if it doesn't exist
+        @rtype: string
+        """
+        if template_name not in self._template_hashes:
+            self._template_hashes[template_name] = \
+                self._hash_template(template_name)
+        return self._template_hashes[template_name]
+
+    def _hash_template(self, template_name):
+        filename = os.path.join(self.template_dir, template_name)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        entry = self.manifest.template_entry(template_name)
+        if entry is not None and not self.paranoid and \
+                (entry['mtime'], entry['size']) == \
+                (stat.st_mtime, stat.st_size):
+            return entry['hash']
+        try:
+            template_file = open(filename, 'rb')
+        except IOError:
+            return None
+        try:
+            template_hash = md5(template_file.read()).hexdigest()
+        finally:
+            template_file.close()
+        mtime = stat.st_mtime
+        if is_racy(mtime):
+            # hashed again next time
+            mtime = None
+        self.manifest.update_template(template_name, template_hash,
+                                      mtime, stat.st_size)
+        return template_hash
+
+    def changes(self):
         """
-        check if configuration file has changed
+        find out which pages require rendering, in a single pass over the
+        source directory
+
+        yields every page with the reason it requires rendering: "new",
+        "content changed", "config changed" or "template changed". Pages
+        that don't need rendering come with None.
+
+        @return: page names and reasons
+        @rtype: iterator of tuples
         """
-        if not self.hash_db.has_key('__config__') or not\
-            self.config_hash == self.hash_db['__config__']:
-            return True
+        self._template_hashes = {}
+        for page in self.pages:
+            yield (page.page_name, page.change_reason)
+        # keep what has been learned about directories and templates
+        self.manifest.commit()
 
     def list_changed(self):
         """
         list all pages that require rendering because they have changed
 
-        lists all pages, if the config file has changed
+        lists all pages, if the config file has changed. Pages rendered with
+        a template that has changed count as changed, too.
 
         @return: lists of changed and unchanged pages
         @rtype: tuple of lists
         """
         changed_pages = []
         unchanged_pages = []
-        if self.config_changed:
-            return ([page.page_name for page in self.pages], [])
-        else:
-            for page in self.pages:
-                if page.has_changed:
-                    changed_pages.append(page.page_name) 
-                else:
-                    unchanged_pages.append(page.page_name)
-            return (changed_pages, unchanged_pages)
+        for page_name, reason in self.changes():
+            if reason:
+                changed_pages.append(page_name)
+            else:
+                unchanged_pages.append(page_name)
+        return (changed_pages, unchanged_pages)
 
-    def render(self, force=False):
+    def render(self, force=False, jobs=1):
         """
         render the project
 
-        renders only changed pages or all pages, if config changed 
+        renders only changed pages or all pages, if config changed. Pages
+        whose template has changed are rendered as well.
+
+        pages are recorded in the manifest along with the config and
+        template they were rendered with, so an interrupted build picks up
+        where it stopped
+
+        pages whose source files are gone are pruned, see `prune`. With a
+        path filter, only the pages it selects are rendered or pruned
 
         @keyword force: if not given, render only pages that have changed
-                        since last run. If given, render everything
+                        since last run. If given, render everything and
+                        convert markdown again rather than use the cache
+        @keyword jobs: number of worker processes to render pages with
+        @return: lists of rendered and unrendered pages
+        @rtype: tuple of lists
+        """
+        page_names = set()
+        def pages():
+            for page in self.pages:
+                page_names.add(page.page_name)
+                yield page
+        self.refresh_caches = force
+        try:
+            result = self._render(pages(), force, jobs)
+            self.pages_pruned = self.prune(page_names)
+            if not self.path_filter:
+                # only a complete build has used the config for all pages
+                self.manifest.set_meta('config', self.config_hash)
+        finally:
+            self.refresh_caches = False
+            # also keeps what has been rendered before an interruption
+            self.manifest.commit()
+        return result
+
+    def prune(self, page_names=None, dry_run=False):
+        """
+        remove the output files and manifest entries of pages whose source
+        files are gone
+
+        nothing is removed if the source directory doesn't exist at all,
+        it's more likely to be misconfigured or not mounted than empty.
+        Pages the path filter rules out are left alone.
+
+        @keyword page_names: names of all existing pages, if known. If not
+                             given, the source directory is searched
+        @type page_names: set of strings
+        @keyword dry_run: only find out what would be removed
+        @return: names of the removed pages
+        @rtype: list of strings
+        """
+        if not os.path.isdir(self.source_dir):
+            return []
+        if page_names is None:
+            page_names = set(page.page_name for page in self.pages)
+        stale_pages = sorted(
+            page_name for page_name in
+            set(self.manifest.page_names()) - page_names
+            if self.path_filter.matches(page_name + self.page_suffix,
+                                        page_name)
+        )
+        if dry_run:
+            return stale_pages
+        output_dir = os.path.join(self.directory, 'output')
+        for page_name in stale_pages:
+            filename = self.output_filename(page_name)
+            for stale_filename in [filename] + sibling_filenames(filename):
+                try:
+                    os.unlink(stale_filename)
+                except OSError:
+                    # removed by hand already or never compressed
+                    pass
+            # remove directories left empty, but not the output directory
+            directory = os.path.dirname(filename)
+            while directory.startswith(output_dir + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+        self.manifest.remove(stale_pages)
+        return stale_pages
+
+    def evict_caches(self):
+        """
+        remove cached markdown conversions that haven't been used for
+        `MARKDOWN_CACHE_MAX_AGE`, e.g. those of page bodies edited since
+
+        @return: number of removed conversions
+        @rtype: int
+        """
+        return self.markdown_cache.evict(MARKDOWN_CACHE_MAX_AGE)
+
+    def output_filename(self, page_name):
+        """
+        path of the html file a page is rendered to
+        """
+        return os.path.join(self.directory, 'output', page_name + '.html')
+
+    def render_pages(self, page_names, force=False):
+        """
+        render some pages of the project, if they have changed
+
+        the source directory isn't searched, pages whose source file doesn't
+        exist are skipped
+
+        @param page_names: names of the pages to render
+        @type page_names: list of strings
+        @keyword force: render the pages even if they haven't changed
+        @return: lists of rendered and unrendered pages
+        @rtype: tuple of lists
+        """
+        pages = [Page(self, page_name) for page_name in page_names]
+        pages = [page for page in pages
+                 if os.path.isfile(page.source_filename)]
+        try:
+            return self._render(pages, force)
+        finally:
+            self.manifest.commit()
+
+    def render_template_users(self, template_name, jobs=1):
+        """
+        render all pages that were rendered with a template
+
+        @param template_name: template filename relative to the templates
+                              directory
+        @type template_name: string
+        @keyword jobs: number of worker processes to render pages with
+        @return: lists of rendered and unrendered pages
+        @rtype: tuple of lists
+        """
+        pages = [Page(self, page_name) for page_name in
+                 self.manifest.pages_using(template_name)]
+        pages = [page for page in pages
+                 if os.path.isfile(page.source_filename)]
+        try:
+            return self._render(pages, True, jobs)
+        finally:
+            self.manifest.commit()
+
+    def page_name_for(self, filename):
+        """
+        name of the page a source file belongs to
+
+        @param filename: path to a file
+        @type filename: string
+        @return: page name, None if the file isn't a source file of this
+                 project
+        @rtype: string
+        """
+        filename = os.path.abspath(filename)
+        if not filename.startswith(self.source_dir + os.sep) or \
+                not filename.endswith(self.page_suffix):
+            return None
+        relative_filename = filename[len(self.source_dir + os.sep):]
+        for name in relative_filename.split(os.sep):
+            if self.ignored(name):
+                return None
+        return relative_filename[:-1 * len(self.page_suffix)]
+
+    def _render(self, pages, force, jobs=1):
+        """
+        render those of the given pages that have changed
+
+        with more than one job, pages are handed to worker processes in
+        batches as soon as they are found to have changed, while the rest
+        are still being checked
+
+        @param pages: pages to consider
+        @type pages: iterable of Page objects
+        @param force: render all pages, changed or not
+        @param jobs: number of worker processes to render pages with
         @return: lists of rendered and unrendered pages
         @rtype: tuple of lists
         """
-        if self.config_changed:
-            force = True
-            self.hash_db['__config__'] = self.config_hash
-            self.hash_db.sync()
         rendered_pages = []
         unrendered_pages = []
-        for page in self.pages:
-            if page.has_changed or force:
-                rendered_pages.append(page.page_name)
-                page.render()
-            else:
-                unrendered_pages.append(page.page_name)
+        pool = None
+        batch = []
+        # batches handed to the workers, with their results
+        pending = deque()
+        self.writes_skipped = 0
+        self._template_hashes = {}
+        try:
+            for page in pages:
+                if not force:
+                    with self.timer.timed('change check',
+                                          page=page.page_name):
+                        has_changed = page.has_changed
+                if force or has_changed:
+                    rendered_pages.append(page.page_name)
+                    if jobs <= 1:
+                        with self.timer.timed('page', page=page.page_name):
+                            written = page.render()
+                        if not written:
+                            self.writes_skipped += 1
+                        continue
+                    # the worker reads the page itself
+                    page.unload()
+                    batch.append(page)
+                    if len(batch) >= self.render_batch_size:
+                        if pool is None:
+                            pool = self._start_pool(jobs)
+                        pending.append(self._submit(pool, batch, jobs))
+                        batch = []
+                    self._collect(pending, wait=False)
+                else:
+                    unrendered_pages.append(page.page_name)
+            if batch:
+                if pool is None:
+                    pool = self._start_pool(jobs)
+                pending.append(self._submit(pool, batch, jobs))
+            self._collect(pending, wait=True)
+            if pool is not None:
+                pool.close()
+        except:
+            if pool is not None:
+                pool.terminate()
+            # finish what this build has queued, its errors mustn't come
+            # up in the next one
+            self.compressor.wait(raise_errors=False)
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
+        self.compressor.wait()
         return (rendered_pages, unrendered_pages)
 
+    def _start_pool(self, jobs):
+        """
+        start the worker processes of a parallel build
+        """
+        return Pool(jobs, _init_worker, (self.directory, self.timer.enabled,
+                                         self.refresh_caches))
+
+    def _submit(self, pool, pages, jobs):
+        """
+        have a batch of pages rendered by the workers
+
+        @param pages: pages to render
+        @type pages: list of Page objects
+        @return: the pages and the pending result of rendering them
+        @rtype: tuple
+        """
+        tasks = [(page.page_name, page.output_hash) for page in pages]
+        return (pages, pool.map_async(_render_worker, tasks,
+                                      max(1, len(tasks) // jobs)))
+
+    def _collect(self, pending, wait):
+        """
+        store the results of rendered batches in the manifest
+
+        workers only write output files, hashes are collected and stored
+        here, in the same order a serial build would.
+
+        @param pending: batches as returned by `_submit`, oldest first.
+                        Collected batches are removed
+        @type pending: deque
+        @param wait: wait for all batches to be rendered. Otherwise only
+                     batches that are done already are collected
+        @type wait: bool
+        """
+        while pending and (wait or pending[0][1].ready()):
+            pages, result = pending.popleft()
+            for page, (page_name, template_name, page_hash, output_hash,
+                       written, stat, events) in zip(pages, result.get()):
+                page.record(page_hash, output_hash, template_name, stat)
+                page.compress(written)
+                self.timer.merge(events)
+                if not written:
+                    self.writes_skipped += 1
+
 class Page(object):
     """
     a single page
+
+    pages are cheap to create: until its header, body or hash is needed, a
+    page only knows its name and, once asked for, the stat data of its
+    source file
     """
+    __slots__ = ('project', 'page_name', 'source_filename', '_stat', '_page',
+                 '_page_hash', '_template_name')
+
     def __init__(self, parent_project, page_name):
         """
         set up a page with both it's parent project name and it's own
@@ -149,100 +870,321 @@ class Page(object):
         """
         self.project = parent_project
         self.page_name = page_name
-        page_file = codecs.open(
-            os.path.join(self.project.source_dir, page_name) \
-              + self.project.page_suffix,
-            'r',
-            'utf-8',
-        )
-        self.page = message_from_string(page_file.read().encode('utf-8'))
-        if self.page.has_key('template'):
-            self.template_name = self.page['template']
-        else:
-            self.template_name = "standard.html"
+        self.source_filename = os.path.join(
+            self.project.source_dir, page_name
+        ) + self.project.page_suffix
+        self._stat = None
+        self._page = None
+        self._page_hash = None
+        self._template_name = None
 
     def __repr__(self):
         return "<Page: %s>" % self.page_name
 
+    @property
+    def stat(self):
+        """
+        modification time, size and inode of the source file
+
+        taken once, before the file is read for the first time
+        """
+        if self._stat is None:
+            stat = os.stat(self.source_filename)
+            self._stat = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'inode': stat.st_ino,
+            }
+        return self._stat
+
+    @property
+    def page(self):
+        """
+        source file split into header and body, read when first needed
+
+        the file is hashed as it is read
+
+        @return: headers as (key, value) pairs and body
+        @rtype: tuple
+        """
+        if self._page is None:
+            # stat before reading, so a later change can't slip through
+            self.stat
+            with self.project.timer.timed('read'):
+                page_file = open(self.source_filename, 'rb')
+                try:
+                    data = page_file.read()
+                finally:
+                    page_file.close()
+                self._page_hash = md5(data).hexdigest()
+                self._page = frontmatter.parse(data)
+        return self._page
+
+    def unload(self):
+        """
+        forget the parsed source file to free memory, hash and template name
+        are kept. Pages that haven't been read are left as they are
+        """
+        if self._page is None:
+            return
+        self.page_hash
+        self.template_name
+        self._page = None
+
+    @property
+    def headers(self):
+        """
+        the page's headers, keys as written
+        
+        @rtype: dict
+        """
+        return frontmatter.header_dict(self.page[0])
+
+    @property
+    def body(self):
+        """
+        the page's contents below its header
+        """
+        return self.page[1].decode('utf-8')
+
+    @property
+    def template_name(self):
+        """
+        template given in the page's header, "standard.html" if none
+        """
+        if self._template_name is None:
+            self._template_name = frontmatter.get_header(
+                self.page[0], 'template', "standard.html"
+            )
+        return self._template_name
+
+    @property
+    def page_hash(self):
+        """
+        md5 hash of the page's source file
+        """
+        if self._page_hash is None:
+            self.page
+        return self._page_hash
+
     def markup(self):
         """
-        render a page using markdown
+        render a page using the project's markdown converter
+
+        the result is cached by the page body and the markdown settings, so
+        pages re-rendered because of config or template changes skip
+        conversion, see `Project.markdown_key`. Forced builds don't use the
+        cache but replace what it holds. Pages with code blocks that could
+        only be escaped, because the highlighter failed, aren't cached.
         
         @return: rendered html contents
         """
-        if self.project.config.get('markdown', 'safe').lower() in [
-                                                               "true",
-                                                               "yes",
-                                                               "on"]:
-            safe_mode = True
-        else:
-            safe_mode = False
-        addons = [addon for addon in 
-                self.project.config.get('markdown', 'addons').split(',')
-                  if addon]
-        return markdown(text=self.page.get_payload().decode('utf-8'),
-              safe_mode=safe_mode,
-              extensions=addons,
-        )
+        body = self.body
+        cache_key = make_key(body, self.project.markdown_key)
+        with self.project.timer.timed('markdown'):
+            html = None
+            if not self.project.refresh_caches:
+                html = self.project.markdown_cache.get(cache_key)
+            if html is None:
+                converter = self.project.markdown
+                converter.reset()
+                html = converter.convert(body)
+                # code the highlighter failed on is tried again next time
+                if not getattr(converter, 'codehilite_fallback', False):
+                    self.project.markdown_cache.set(cache_key, html)
+        return html
 
-    def _render_template(self):
+    def _render_template(self, stream=None):
         """
         render page's contents into a template
 
         if the pages has an attribute "temlate" in it's header, it will be used
         instead of the default "standard.html" template.
 
-        @return: complete html page
+        @keyword stream: file like object to write the page to, encoded as
+                         utf-8, as it is rendered
+        @return: complete html page, None if written to a stream
         @rtype: string
         """
-        template = templates.Template.from_file(
-            os.path.join(
-                self.project.directory, 
-                'templates',
-                self.template_name)
+        timer = self.project.timer
+        with timer.timed('template load', template=self.template_name):
+            template = self.project.template_cache.get(
+                os.path.join(self.project.template_dir, self.template_name)
             )
         contents = {
             'content':self.markup(),
         }
         # add additional headers from the source into template context
-        contents.update(self.page)
-        return template.render(contents)
+        contents.update(self.headers)
+        with timer.timed('template render', template=self.template_name):
+            if stream is not None:
+                template.render_to(stream, contents)
+            else:
+                return template.render(contents)
 
     @property
     def has_changed(self):
         """
-        check if contents of the page have changed or the page is all new
+        check if contents of the page or its template have changed or the
+        page is all new
         """
-        if not self.project.hash_db.has_key(self.page_name):
-            return True
-        page_hash = md5(self.page.as_string()).hexdigest()
-        if self.project.hash_db[self.page_name] == page_hash:
-            return False
-        else:
-            return True
+        return self.change_reason is not None
+
+    @property
+    def change_reason(self):
+        """
+        find out why the page needs rendering
+
+        if the source file's stat data matches the one recorded with the
+        last rendering, the file isn't read at all, unless the project is
+        paranoid. Modification times too recent to be trusted aren't
+        recorded, see `trusted_stat`.
+
+        @return: "new", "content changed", "template changed" or None, if
+                 the page doesn't need rendering
+        @rtype: string
+        """
+        project = self.project
+        entry = project.manifest.entry(self.page_name)
+        if entry is None or entry['hash'] is None:
+            return 'new'
+        stat = self.stat
+        if project.paranoid or not all(
+                entry[key] == stat[key] for key in stat):
+            if entry['hash'] != self.page_hash:
+                return 'content changed'
+            # touched but not changed, remember the new stat data so the
+            # next check takes the fast path again
+            project.manifest.update(self.page_name, **trusted_stat(stat))
+        # older versions of sr only recorded the config project wide
+        config_hash = entry['config'] or project.manifest.get_meta('config')
+        if config_hash != project.config_hash:
+            return 'config changed'
+        template_name = entry['template']
+        if template_name is None:
+            template_name = self.template_name
+            project.manifest.update(self.page_name, template=template_name)
+        if entry['template_hash'] is None or \
+                entry['template_hash'] != project.template_hash(template_name):
+            return 'template changed'
+        return None
 
     def render(self):
         """
-        render the page into a static html file
+        render the page into a static html file and remember its hash
 
         if `force` isn't true, md5 hashes will be compared to find out
-        if re-rendering the page is really necessary.
+        if re-rendering the page is really necessary. The hash is written
+        to disk when the project commits its manifest. Compressed copies
+        are written as configured, see `compress`.
+
+        @return: whether the output file was written, it isn't if its
+                 contents didn't change
+        @rtype: bool
+        """
+        page_hash, output_hash, written = self.write_output(self.output_hash)
+        self.record(page_hash, output_hash)
+        self.compress(written)
+        return written
+
+    def compress(self, written):
         """
-        target_filename = os.path.join(
-            self.project.directory,
-            'output',
-            self.page_name + '.html'
+        have compressed copies of the output file written in the
+        background, if the project is configured to
+
+        @param written: whether the output file has just been written. If
+                        it hasn't, only missing copies are written
+        @type written: bool
+        """
+        self.project.compressor.submit(
+            self.project.output_filename(self.page_name),
+            self.page_name,
+            only_missing=not written,
         )
-        target_dir = os.path.dirname(target_filename)
-        if not os.path.isdir(target_dir):
-            os.makedirs(target_dir)
-        output_file = codecs.open(
-            target_filename,
-            'w',
-            'utf-8',
+
+    @property
+    def output_hash(self):
+        """
+        md5 hash of the output file as recorded in the manifest
+        """
+        entry = self.project.manifest.entry(self.page_name)
+        if entry is None:
+            return None
+        return entry['output_hash']
+
+    def record(self, page_hash, output_hash, template_name=None, stat=None):
+        """
+        remember the hashes and stat data of a rendered page in the manifest,
+        along with the config and template it was rendered with
+
+        only call this once the output has been written
+
+        @param page_hash: hash of the page source as it was rendered
+        @type page_hash: string
+        @param output_hash: hash of the output file
+        @type output_hash: string
+        @keyword template_name: template the page was rendered with, if
+                                known without reading the page
+        @type template_name: string
+        @keyword stat: stat data of the source file taken before it was
+                       read for rendering, e.g. by a worker process. The
+                       page's own is used if not given
+        @type stat: dict
+        """
+        if template_name is None:
+            template_name = self.template_name
+        if stat is None:
+            stat = self.stat
+        self.project.manifest.update(
+            self.page_name,
+            hash=page_hash,
+            output_hash=output_hash,
+            config=self.project.config_hash,
+            template=template_name,
+            template_hash=self.project.template_hash(template_name),
+            **trusted_stat(stat)
         )
-        new_page_hash = md5(self.page.as_string()).hexdigest()
-        self.project.hash_db[self.page_name] = new_page_hash
-        self.project.hash_db.sync()
-        output_file.write(self._render_template())
-        output_file.close()
+
+    def render_html(self):
+        """
+        render the page without writing it anywhere or touching the manifest
+
+        @return: complete html page
+        @rtype: string, utf-8 encoded
+        """
+        return self._render_template().encode('utf-8')
+
+    def write_output(self, old_output_hash=None):
+        """
+        write the rendered page to the output directory
+
+        doesn't touch the manifest, so this is safe to call from worker
+        processes. The output is written to a temporary file first and
+        renamed into place, an interrupted write never leaves a truncated
+        page behind. Large pages are streamed into that file as they are
+        rendered rather than held in memory.
+
+        @keyword old_output_hash: hash of the existing output file. If the
+                                  new output has the same hash, the file
+                                  isn't rewritten and keeps its mtime
+        @type old_output_hash: string
+        @return: md5 hashes of the page source and of the output, and
+                 whether the output file was written
+        @rtype: tuple
+        """
+        target_filename = self.project.output_filename(self.page_name)
+        output_file = OutputFile(target_filename)
+        try:
+            self._render_template(output_file)
+            output_hash = output_file.hexdigest()
+            page_hash = self.page_hash
+            self.unload()
+            if output_hash == old_output_hash and \
+                    os.path.isfile(target_filename):
+                output_file.discard()
+                return (page_hash, output_hash, False)
+            with self.project.timer.timed('write'):
+                output_file.commit()
+        finally:
+            output_file.discard()
+        return (page_hash, output_hash, True)
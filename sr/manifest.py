@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+manifest
+--------
+
+The manifest remembers what has been rendered: page hashes, the stat data of
+the source files they were computed from, the config and template each page
+was rendered with, hashes of the output files and project wide values such as
+the hash of the config file. It also keeps the directory index, the listings
+of the source directories along with their modification times. It is stored
+in an SQLite database inside the project directory. Changes are collected in
+memory and written in batches inside a single transaction, which is committed
+once per build.
+"""
+
+import os
+import shelve
+import sqlite3
+
+class Manifest(object):
+    """
+    persistent store of page hashes
+
+    per page values are read with `entry` and written with `update`,
+    assigning to a page name stores just its hash
+    """
+    batch_size = 500
+    # per page columns besides the page name, with their SQL types
+    columns = (
+        ('hash', 'TEXT'),
+        ('mtime', 'REAL'),
+        ('size', 'INTEGER'),
+        ('inode', 'INTEGER'),
+        ('config', 'TEXT'),
+        ('template', 'TEXT'),
+        ('template_hash', 'TEXT'),
+        ('output_hash', 'TEXT'),
+    )
+
+    def __init__(self, filename, legacy_filename=None):
+        """
+        open the manifest database, creating it if necessary
+
+        @param filename: path to the manifest database
+        @type filename: string
+        @keyword legacy_filename: path to a hash db shelve from older versions
+                                  of sr. Its contents are migrated once, when
+                                  the manifest is created
+        @type legacy_filename: string
+        """
+        self.filename = filename
+        is_new = not os.path.exists(filename)
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS pages (name TEXT PRIMARY KEY)'
+        )
+        self._upgrade()
+        # reverse index from templates to the pages using them
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS pages_template ON pages (template)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS templates '
+            '(name TEXT PRIMARY KEY, hash TEXT, mtime REAL, size INTEGER)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS meta '
+            '(key TEXT PRIMARY KEY, value TEXT)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS directories '
+            '(name TEXT PRIMARY KEY, mtime REAL, files TEXT, '
+            'subdirectories TEXT)'
+        )
+        self._pending = {}
+        if is_new and legacy_filename:
+            self.migrate(legacy_filename)
+        self.commit()
+
+    def _upgrade(self):
+        """
+        add columns that manifests written by older versions lack
+        """
+        existing = [row[1] for row in
+                    self.db.execute('PRAGMA table_info(pages)')]
+        for column, column_type in self.columns:
+            if column not in existing:
+                self.db.execute(
+                    'ALTER TABLE pages ADD COLUMN %s %s' %
+                    (column, column_type)
+                )
+
+    def migrate(self, legacy_filename):
+        """
+        copy all entries of an old shelve based hash db into the manifest
+
+        @param legacy_filename: path to the hash db shelve
+        @type legacy_filename: string
+        @return: number of migrated pages
+        @rtype: int
+        """
+        try:
+            hash_db = shelve.open(legacy_filename, 'r')
+        except Exception:
+            # no hash db yet or one we can't read, nothing to migrate
+            return 0
+        migrated = 0
+        try:
+            for key in hash_db.keys():
+                if key == '__config__':
+                    self.set_meta('config', hash_db[key])
+                else:
+                    self[key] = hash_db[key]
+                    migrated += 1
+        finally:
+            hash_db.close()
+        return migrated
+
+    def entry(self, page_name):
+        """
+        read everything stored about a page
+
+        @param page_name: name of the page
+        @type page_name: string
+        @return: column names mapped to values, None if the page is unknown
+        @rtype: dict
+        """
+        row = self.db.execute(
+            'SELECT %s FROM pages WHERE name = ?' %
+            ', '.join(column for column, column_type in self.columns),
+            (page_name,)
+        ).fetchone()
+        if row is None and page_name not in self._pending:
+            return None
+        if row is None:
+            entry = dict.fromkeys(column for column, column_type
+                                  in self.columns)
+        else:
+            entry = dict(zip(
+                [column for column, column_type in self.columns], row
+            ))
+        entry.update(self._pending.get(page_name, {}))
+        return entry
+
+    def update(self, page_name, **values):
+        """
+        store values about a page, written with the next flush
+
+        @param page_name: name of the page
+        @type page_name: string
+        @param values: column names mapped to new values
+        """
+        self._pending.setdefault(page_name, {}).update(values)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def __setitem__(self, page_name, page_hash):
+        self.update(page_name, hash=page_hash)
+
+    def page_names(self):
+        """
+        names of all pages in the manifest
+
+        @rtype: list of strings
+        """
+        self.flush()
+        return [row[0] for row in self.db.execute('SELECT name FROM pages')]
+
+    def remove(self, page_names):
+        """
+        forget pages, written with the next commit
+
+        @param page_names: names of the pages
+        @type page_names: list of strings
+        """
+        for page_name in page_names:
+            self._pending.pop(page_name, None)
+        self.db.executemany(
+            'DELETE FROM pages WHERE name = ?',
+            [(page_name,) for page_name in page_names]
+        )
+
+    def pages_using(self, template_name):
+        """
+        names of all pages rendered with a template
+
+        @param template_name: template filename relative to the templates
+                              directory
+        @type template_name: string
+        @rtype: list of strings
+        """
+        self.flush()
+        return [row[0] for row in self.db.execute(
+            'SELECT name FROM pages WHERE template = ?', (template_name,)
+        )]
+
+    def template_entry(self, template_name):
+        """
+        read the hash a template had when last hashed, with its stat data
+
+        @return: column names mapped to values, None if the template is
+                 unknown
+        @rtype: dict
+        """
+        row = self.db.execute(
+            'SELECT hash, mtime, size FROM templates WHERE name = ?',
+            (template_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('hash', 'mtime', 'size'), row))
+
+    def update_template(self, template_name, template_hash, mtime, size):
+        """
+        store hash and stat data of a template, written with the next commit
+        """
+        self.db.execute(
+            'INSERT OR REPLACE INTO templates (name, hash, mtime, size) '
+            'VALUES (?, ?, ?, ?)',
+            (template_name, template_hash, mtime, size)
+        )
+
+    def directories(self):
+        """
+        read the directory index
+
+        @return: directory names relative to the source directory mapped to
+                 their modification time and the names of their files and
+                 subdirectories when they were last listed
+        @rtype: dict
+        """
+        def split(names):
+            if not names:
+                return []
+            return names.split('/')
+        return dict(
+            (name, (mtime, split(files), split(subdirectories)))
+            for name, mtime, files, subdirectories in self.db.execute(
+                'SELECT name, mtime, files, subdirectories FROM directories'
+            )
+        )
+
+    def update_directory(self, name, mtime, files, subdirectories):
+        """
+        store the listing of a directory, written with the next commit
+
+        @param name: directory name relative to the source directory
+        @type name: string
+        @param mtime: modification time of the directory when it was listed
+        @type mtime: float
+        @param files: names of the files in the directory
+        @type files: list of strings
+        @param subdirectories: names of the subdirectories
+        @type subdirectories: list of strings
+        """
+        # names can't contain slashes
+        self.db.execute(
+            'INSERT OR REPLACE INTO directories '
+            '(name, mtime, files, subdirectories) VALUES (?, ?, ?, ?)',
+            (name, mtime, '/'.join(files), '/'.join(subdirectories))
+        )
+
+    def remove_directory(self, name):
+        """
+        forget the listings of a directory and all directories below it
+        """
+        self.db.execute(
+            'DELETE FROM directories WHERE name = ? OR '
+            'substr(name, 1, ?) = ?',
+            (name, len(name) + 1, name + '/')
+        )
+
+    def get_meta(self, key, default=None):
+        """
+        read a project wide value, e.g. the hash of the config file
+        """
+        row = self.db.execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def set_meta(self, key, value):
+        """
+        store a project wide value, written with the next commit
+        """
+        self.db.execute(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            (key, value)
+        )
+
+    def flush(self):
+        """
+        write pending page values into the open transaction
+        """
+        if not self._pending:
+            return
+        self.db.executemany(
+            'INSERT OR IGNORE INTO pages (name) VALUES (?)',
+            [(page_name,) for page_name in self._pending]
+        )
+        # group updates by the columns they touch to batch them
+        updates = {}
+        for page_name, values in self._pending.iteritems():
+            columns = tuple(sorted(values))
+            updates.setdefault(columns, []).append(
+                [values[column] for column in columns] + [page_name]
+            )
+        for columns, rows in updates.iteritems():
+            self.db.executemany(
+                'UPDATE pages SET %s WHERE name = ?' %
+                ', '.join('%s = ?' % column for column in columns),
+                rows
+            )
+        self._pending.clear()
+
+    def commit(self):
+        """
+        write pending page values and commit the transaction
+        """
+        self.flush()
+        self.db.commit()
+
+    def close(self):
+        """
+        commit and close the manifest
+        """
+        self.commit()
+        self.db.close()
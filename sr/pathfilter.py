@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+pathfilter
+----------
+
+Restricts builds to parts of a project with globs on paths relative to the
+source directory, as given to render --only and --exclude:
+
+    - "*" and "?" match within a single directory name
+    - "**" matches across directories, "docs/**" matches docs itself as well
+    - a glob matching a directory matches everything below it, so
+      "docs/api" selects the whole subtree
+    - a page matches by its source filename or its page name, e.g.
+      "about.txt" or "about"
+
+Filters are applied while the source directory is searched, directories
+that can't contain matching pages aren't even listed.
+"""
+
+import re
+
+def translate(pattern):
+    """
+    turn a glob into a regular expression matching whole paths
+
+    @param pattern: glob as described above
+    @type pattern: string
+    @rtype: compiled regular expression
+    """
+    pattern = pattern.strip('/')
+    result = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('/**', index) and \
+                index + 3 == len(pattern):
+            result.append('(?:/.*)?')
+            index += 3
+        elif pattern.startswith('**/', index):
+            result.append('(?:.*/)?')
+            index += 3
+        elif pattern.startswith('**', index):
+            result.append('.*')
+            index += 2
+        elif pattern[index] == '*':
+            result.append('[^/]*')
+            index += 1
+        elif pattern[index] == '?':
+            result.append('[^/]')
+            index += 1
+        else:
+            result.append(re.escape(pattern[index]))
+            index += 1
+    return re.compile(''.join(result) + r'\Z')
+
+def static_prefix(pattern):
+    """
+    the leading directory names of a glob that contain no wildcards
+    """
+    names = []
+    for name in pattern.strip('/').split('/'):
+        if '*' in name or '?' in name:
+            break
+        names.append(name)
+    return '/'.join(names)
+
+class PathFilter(object):
+    """
+    decides which pages and directories a build looks at
+    """
+    def __init__(self, only=None, exclude=None):
+        """
+        @keyword only: globs pages have to match one of, all pages match
+                       if none are given
+        @type only: list of strings
+        @keyword exclude: globs pages mustn't match any of
+        @type exclude: list of strings
+        """
+        self.only = list(only or [])
+        self.exclude = list(exclude or [])
+        self._only_res = [translate(pattern) for pattern in self.only]
+        self._only_prefixes = [static_prefix(pattern)
+                               for pattern in self.only]
+        self._exclude_res = [translate(pattern) for pattern in self.exclude]
+
+    def __nonzero__(self):
+        return bool(self.only or self.exclude)
+
+    def _matches_any(self, regexes, path):
+        """
+        check if a path or one of its parent directories matches
+        """
+        while path:
+            for regex in regexes:
+                if regex.match(path):
+                    return True
+            path = path.rpartition('/')[0]
+        return False
+
+    def matches(self, filename, page_name):
+        """
+        check if a page is part of the build
+
+        @param filename: source filename relative to the source directory
+        @type filename: string
+        @param page_name: name of the page
+        @type page_name: string
+        """
+        if self._matches_any(self._exclude_res, filename) or \
+                self._matches_any(self._exclude_res, page_name):
+            return False
+        if not self.only:
+            return True
+        return self._matches_any(self._only_res, filename) or \
+            self._matches_any(self._only_res, page_name)
+
+    def descend(self, directory):
+        """
+        check if a directory may contain pages that are part of the build
+
+        @param directory: directory relative to the source directory
+        @type directory: string
+        """
+        if not directory:
+            return True
+        if self._matches_any(self._exclude_res, directory):
+            return False
+        if not self.only:
+            return True
+        for prefix in self._only_prefixes:
+            if not prefix or prefix == directory or \
+                    prefix.startswith(directory + '/') or \
+                    directory.startswith(prefix + '/'):
+                return True
+        return False
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+preview
+-------
+
+A local HTTP server rendering pages on demand, for looking at a page without
+rendering the whole project. A request for /foo/bar.html renders
+source/foo/bar.txt, directories are served their index page.
+
+Pages are rendered like in a build, using the compiled template and markdown
+caches, but neither the output directory nor the manifest are touched.
+Responses carry an ETag computed from the hashes of the page, its template
+and the config, so browsers revalidating an unchanged page get a 304 without
+the page being rendered at all.
+"""
+
+import os
+import sys
+import urllib
+import posixpath
+import BaseHTTPServer
+from md5 import md5
+
+from libsr import Project, Page
+from cache import make_key
+
+class PreviewServer(BaseHTTPServer.HTTPServer):
+    """
+    HTTP server keeping a project loaded, reloaded when its config changes
+    """
+    def __init__(self, directory, address=('127.0.0.1', 8000)):
+        """
+        @param directory: path to the project directory
+        @type directory: string
+        @keyword address: host and port to listen on
+        @type address: tuple
+        """
+        self.directory = os.path.abspath(directory)
+        self.config_filename = os.path.join(self.directory, 'config.ini')
+        self._project = None
+        self._config_stat = None
+        BaseHTTPServer.HTTPServer.__init__(self, address, PreviewHandler)
+
+    @property
+    def project(self):
+        """
+        the project, without a manifest
+        """
+        try:
+            stat = os.stat(self.config_filename)
+            config_stat = (stat.st_mtime, stat.st_size)
+        except OSError:
+            config_stat = None
+        if self._project is None or config_stat != self._config_stat:
+            self._project = Project(self.directory, use_manifest=False)
+            self._config_stat = config_stat
+        return self._project
+
+    def page_name_for(self, path):
+        """
+        name of the page a request path refers to
+
+        @param path: path part of the requested URL
+        @type path: string
+        @return: page name, None if the path can't refer to a page
+        @rtype: string
+        """
+        path = posixpath.normpath(urllib.unquote(path))
+        if path.startswith('..') or '/../' in path:
+            return None
+        path = path.lstrip('/')
+        if not path or path.endswith('/') or \
+                os.path.isdir(os.path.join(self.project.source_dir, path)):
+            path = posixpath.join(path, 'index.html')
+        if not path.endswith('.html'):
+            return None
+        return path[:-len('.html')]
+
+    def etag(self, page):
+        """
+        entity tag of a page, changes whenever its rendering would
+
+        @param page: page to compute the tag of
+        @type page: Page object from libsr
+        @rtype: string
+        """
+        template_file = open(os.path.join(self.project.template_dir,
+                                          page.template_name), 'rb')
+        try:
+            template_hash = md5(template_file.read()).hexdigest()
+        finally:
+            template_file.close()
+        return '"%s"' % make_key(page.page_hash, template_hash,
+                                 self.project.config_hash,
+                                 self.project.markdown_key)
+
+class PreviewHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    renders the requested page
+    """
+    server_version = 'SR-preview'
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        project = self.server.project
+        page_name = self.server.page_name_for(self.path.split('?', 1)[0])
+        if page_name is None:
+            self.send_error(404)
+            return
+        page = Page(project, page_name)
+        if not os.path.isfile(page.source_filename):
+            self.send_error(404, "No page %s" % page_name)
+            return
+        try:
+            etag = self.server.etag(page)
+            if etag in self.headers.get('If-None-Match', '').split(', '):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            html = page.render_html()
+        except Exception, error:
+            self.log_error("rendering %s failed: %r", page_name, error)
+            self.send_error(500, "Rendering %s failed: %s" %
+                            (page_name, error))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(html)))
+        self.send_header('ETag', etag)
+        # always revalidate, the page may change any moment
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(html)
+
+def serve(directory, port=8000, out=sys.stdout):
+    """
+    preview a project until interrupted
+
+    @param directory: path to the project directory
+    @type directory: string
+    @keyword port: port to listen on, on localhost only
+    @type port: int
+    """
+    server = PreviewServer(directory, ('127.0.0.1', port))
+    print >> out, "Previewing %s on http://127.0.0.1:%d/" % (
+        server.directory, server.server_address[1]
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -17,21 +17,62 @@ in libsr.py
     - create /path/to/project/directory: 
     create a new project
 
-    - list /path/to/project/directory:
-    list all files that have changed in a project
+    - list [--paranoid] [--format json] /path/to/project/directory:
+    list all files that have changed in a project.
+    When passing --paranoid, hash every file instead of trusting
+    unchanged modification times and sizes.
+    When passing --format json, print a JSON list of all pages with
+    their status and the reason they need rendering
 
-    - render [--force] /path/to/directory:
+    - render [--force] [--jobs N] [--profile] [--trace FILE] /path/to/directory:
     render all files that have changed in a project.
-    When passing --force, render all files, changed or no
+    When passing --force, render all files, changed or no.
+    When passing --jobs, render pages in N worker processes.
+    When passing --profile, print how long the phases of the build took
+    and which pages and templates were slowest. --trace writes these
+    timings as a Chrome trace event file.
+    Output files and manifest entries of pages whose source files are
+    gone are removed.
+    When passing --only GLOB or --exclude GLOB, possibly more than once,
+    only pages matching one of the --only globs and none of the --exclude
+    globs are looked at, e.g. --only 'docs/api/**'. Globs match paths
+    relative to the source directory, "**" matches across directories.
+    They work for list and prune as well.
+    --paranoid works as for list
+
+    - prune [--dry-run] /path/to/directory:
+    remove output files and manifest entries of pages whose source files
+    are gone, without rendering anything, as well as cached markdown
+    conversions not used for 30 days. When passing --dry-run, only
+    list what would be removed
+
+    Caches are kept in the project's .cache directory. It can be deleted
+    at any time to clear them, render --force doesn't use cached markdown
+    conversions either
+
+    - watch [--jobs N] /path/to/directory:
+    render all files that have changed, then keep watching the project
+    and render pages as soon as they or their templates change
+
+    - preview [--port N] /path/to/directory:
+    serve the project's pages on http://127.0.0.1:N/, rendering each
+    page when it is requested without writing output files
+
+    - serve-daemon [--socket PATH]:
+    keep projects loaded and serve render, list and prune requests over a
+    Unix socket. While the daemon is running, these are forwarded to it
+    unless --no-daemon is given. Builds with --profile or --trace
+    always run locally
 
 """
 
 
 import os
 import sys
+import json
 from ConfigParser import SafeConfigParser
 
-from libsr import Project
+import daemon
 
 def create(directory):
     """
@@ -52,6 +93,7 @@ def create(directory):
     config.set('markdown', 'safe', 'False')
     config.set('markdown', 'addons', ',')
     config.set('general', 'suffix', '.txt')
+    config.set('general', 'ignore', '.*, *~, #*#')
     config.write(config_file)
     config_file.close()
     standard_template = open(os.path.join(
@@ -63,25 +105,82 @@ def create(directory):
     standard_template.close()
     print "Created a new project under %s" % directory
 
-def list_changed(project):
+def list_changed(project, format='text'):
     """
     print all files that need re-rendering in given project
 
+    the project is searched once, pages are printed as they are found.
+    In text format, pages that don't need rendering are printed last.
+
     @param project: project to check for changed files
     @type project: project object from libsr
+    @keyword format: "text" or "json"
     """
+    if format == 'json':
+        sys.stdout.write('[')
+        separator = '\n'
+        for page_name, reason in project.changes():
+            sys.stdout.write(separator + json.dumps({
+                'page': page_name,
+                'status': reason and 'changed' or 'unchanged',
+                'reason': reason,
+            }))
+            separator = ',\n'
+        sys.stdout.write('\n]\n')
+        return
+    unchanged_pages = []
     print "Files that need re-rendering: "
-    for changed_page in project.list_changed()[0]:
-        print " " + changed_page
+    for page_name, reason in project.changes():
+        if reason:
+            print " " + page_name
+        else:
+            unchanged_pages.append(page_name)
     print "Files that don't need to be rendered: "
-    for unchanged_page in project.list_changed()[1]:
+    for unchanged_page in unchanged_pages:
         print " " + unchanged_page
 
+def run_command(command, project, options):
+    """
+    render, list or prune a project, printing the results
+
+    used for commands run locally as well as those forwarded to the daemon
+
+    @param command: "render", "list" or "prune"
+    @type command: string
+    @param project: project to work on
+    @type project: project object from libsr
+    @param options: parsed command line options
+    """
+    if command == "render":
+        result_pages = project.render(force=options.force,
+                                      jobs=options.jobs)
+        print "Pages rendered:"
+        print "\n".join(result_pages[0]) or "None"
+        print "Pages not rendered:" or "None"
+        print "\n".join(result_pages[1])
+        print "Output files left alone, their contents didn't change: %d" % \
+            project.writes_skipped
+        print "Pages removed, their source files are gone:"
+        print "\n".join(project.pages_pruned) or "None"
+    elif command == "list":
+        list_changed(project, options.format)
+    elif command == "prune":
+        pruned_pages = project.prune(dry_run=options.dry_run)
+        if options.dry_run:
+            print "Pages that would be removed:"
+        else:
+            project.manifest.commit()
+            print "Pages removed:"
+        print "\n".join(pruned_pages) or "None"
+        if not options.dry_run:
+            print "Unused cached markdown conversions removed: %d" % \
+                project.evict_caches()
+
 def main():
     from optparse import OptionParser
     parser = OptionParser()
     usage = """\
-     %prog [-f] command directory
+     %prog [-f] [-j N] [--paranoid] [--format F] command directory
 
     Supported commands:
 
@@ -89,30 +188,137 @@ def main():
         creates a new project under given directory
     list /path/to/project/dir
         list all files that have changed since last rendering in given dir
-    render --force /path/to/project/dir
+        hash every file when given the --paranoid parameter
+        print JSON when given --format json
+    render --force --jobs N /path/to/project/dir
         render all files that have changed since last rendering 
         render all files when given the --force parameter
+        render in N worker processes when given the --jobs parameter
+        only look at pages matching --only GLOB and not --exclude GLOB
+        print timings when given --profile, write a trace with --trace FILE
+    watch --jobs N /path/to/project/dir
+        render all files that have changed, then keep rendering
+        whatever changes until interrupted
+    preview --port N /path/to/project/dir
+        serve pages rendered on demand on http://127.0.0.1:N/
+    prune --dry-run /path/to/project/dir
+        remove outputs and manifest entries of pages whose source is gone
+        and cached markdown unused for 30 days
+        only list pages when given --dry-run
+    serve-daemon --socket PATH
+        keep projects loaded and answer render, list and prune requests, which
+        are forwarded to the daemon while it runs unless given --no-daemon
    """
     parser = OptionParser(usage=usage)
     parser.add_option('-f', '--force', default=False, action="store_true",
             dest="force", help="Force rendering even if pages haven't changed"
     )
+    parser.add_option('-j', '--jobs', default=1, type="int",
+            dest="jobs", help="Number of worker processes to render with"
+    )
+    parser.add_option('--paranoid', default=False, action="store_true",
+            dest="paranoid", help="Hash pages even if their size and "
+            "modification time haven't changed"
+    )
+    parser.add_option('--format', default="text", type="choice",
+            choices=["text", "json"], dest="format",
+            help="Output format of the list command: text or json"
+    )
+    parser.add_option('--profile', default=False, action="store_true",
+            dest="profile", help="Print how long rendering took, per phase "
+            "and for the slowest pages and templates"
+    )
+    parser.add_option('--top', default=10, type="int", dest="top",
+            help="Number of slowest pages and templates to show with "
+            "--profile"
+    )
+    parser.add_option('--trace', default=None, dest="trace",
+            metavar="FILE", help="Write render timings to FILE as Chrome "
+            "trace events"
+    )
+    parser.add_option('--socket', default=None, dest="socket",
+            metavar="PATH", help="Unix socket of the daemon [%s]" %
+            daemon.default_socket_path()
+    )
+    parser.add_option('--no-daemon', default=False, action="store_true",
+            dest="no_daemon", help="Run render, list and prune here even if a "
+            "daemon is running"
+    )
+    parser.add_option('--only', default=[], action="append", dest="only",
+            metavar="GLOB", help="Only look at pages matching GLOB, e.g. "
+            "'docs/api/**'. May be given more than once"
+    )
+    parser.add_option('--exclude', default=[], action="append",
+            dest="exclude", metavar="GLOB", help="Leave out pages matching "
+            "GLOB. May be given more than once"
+    )
+    parser.add_option('--dry-run', default=False, action="store_true",
+            dest="dry_run", help="With prune, only list what would be "
+            "removed"
+    )
+    parser.add_option('--port', default=8000, type="int", dest="port",
+            help="Port the preview server listens on [%default]"
+    )
     (options, args) = parser.parse_args()
+    if args == ["serve-daemon"]:
+        try:
+            daemon.Daemon(run_command, options.socket).serve()
+        except KeyboardInterrupt:
+            pass
+        return
     try:
         (command, proj_dir) = args
     except ValueError:
         parser.print_usage()
         sys.exit(1)
+    if command in ("render", "list", "prune") and not (options.no_daemon or
+            options.profile or options.trace):
+        response = daemon.request(command, proj_dir, {
+            'force': options.force,
+            'jobs': options.jobs,
+            'paranoid': options.paranoid,
+            'format': options.format,
+            'dry_run': options.dry_run,
+            'only': options.only,
+            'exclude': options.exclude,
+        }, options.socket)
+        if response is not None:
+            status, output = response
+            sys.stdout.write(output.encode('utf-8'))
+            sys.exit(status)
+    # imported only now, forwarding to the daemon doesn't need markdown
+    from libsr import Project
+    from timing import Timer
+    from pathfilter import PathFilter
+    path_filter = PathFilter(options.only, options.exclude)
     if command == "render":
-        project = Project(proj_dir)
-        result_pages = project.render(force=options.force)
-        print "Pages rendered:"
-        print "\n".join(result_pages[0]) or "None"
-        print "Pages not rendered:" or "None"
-        print "\n".join(result_pages[1])
-    elif command == "list":
-        project = Project(proj_dir)
-        list_changed(project)
+        timer = None
+        if options.profile or options.trace:
+            timer = Timer()
+        project = Project(proj_dir, paranoid=options.paranoid, timer=timer,
+                          path_filter=path_filter)
+        run_command(command, project, options)
+        if options.profile:
+            timer.report(sys.stdout, options.top)
+        if options.trace:
+            timer.write_trace(options.trace)
+    elif command in ("list", "prune"):
+        project = Project(proj_dir, paranoid=options.paranoid,
+                          path_filter=path_filter)
+        run_command(command, project, options)
+    elif command == "watch":
+        from watch import Watcher
+        watcher = Watcher(proj_dir, jobs=options.jobs)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+    elif command == "preview":
+        from preview import serve
+        try:
+            serve(proj_dir, options.port)
+        except KeyboardInterrupt:
+            pass
     elif command == "create":
         create(proj_dir)
     else:
@@ -19,6 +19,23 @@ r"""
 
         t = Template.from_file('test.html')
 
+    Templates run with a plain dictionary as their namespace. Every name
+    the compiled code can look up is bound before it runs, to the value
+    passed to `render`, a builtin or `Undefined`, so lookups never leave
+    the dictionary.
+
+    Large output doesn't have to be held in memory as a whole, it can be
+    written to a file as it is rendered::
+
+        t.render_to(open('users.html', 'wb'), users=users)
+
+    Compiling a template is expensive. A `TemplateCache` keeps compiled
+    templates in memory and, if given a directory, marshals their code
+    objects to disk so other processes can skip compilation as well::
+
+        cache = TemplateCache('/tmp/template-cache')
+        t = cache.get('test.html')
+
     The syntax elements are a mixture of django, genshi text and mod_python
     templates and used internally in werkzeug components.
 
@@ -110,14 +127,22 @@ r"""
     :copyright: 2006 by Armin Ronacher, Ka-Ping Yee.
     :license: BSD License.
 """
+import os
 import sys
 import re
+import imp
+import types
+import urllib
+import marshal
+from md5 import md5
 import __builtin__ as builtins
 from compiler import ast, parse
 from compiler.pycodegen import ModuleCodeGenerator
 from tokenize import PseudoToken
 import cgi
 
+from atomic import write_atomically
+
 token_re = re.compile('%s|%s|%s(?i)' % (
     r'[uU]?[rR]?"""([^"\\]*(?:\\.[^"\\]*)*)"""',
     r"[uU]?[rR]?'''([^'\\]*(?:\\.[^'\\]*)*)'''",
@@ -175,6 +200,25 @@ def transform(node, filename):
     return root
 
 
+def compile_template(source, filename):
+    node = Parser(tokenize('\n'.join(source.splitlines()),
+                           filename), filename).parse()
+    return ModuleCodeGenerator(transform(node, filename)).getCode()
+
+
+def code_names(code):
+    """
+    All names a code object and the functions, lambdas and generator
+    expressions inside it refer to.  Attribute names are included, binding
+    them as well does no harm.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(code_names(const))
+    return frozenset(names)
+
+
 class TemplateSyntaxError(SyntaxError):
 
     def __init__(self, msg, filename, lineno):
@@ -341,21 +385,67 @@ class Parser(object):
 
 class Context(object):
 
-    def __init__(self, namespace, encoding, errors):
+    def __init__(self, namespace, encoding, errors, stream=None,
+                 buffer_size=None):
         self.encoding = encoding
         self.errors = errors
         self._namespace = namespace
         self._buffer = []
-        self._write = self._buffer.append
-        _extend = self._buffer.extend
+        if stream is None:
+            self._write = self._buffer.append
+            self._extend = self._buffer.extend
+        else:
+            self._stream = stream
+            self._buffer_size = buffer_size
+            self._buffered = 0
+            self._write = self._stream_write
+            self._extend = self._stream_extend
         self._namespace.update(
             Undefined=undefined,
             __to_unicode=self.to_unicode,
             __context=self,
             __write=self._write,
-            __write_many=lambda *a: _extend(a)
+            __write_many=self._write_many
         )
 
+    def _write_many(self, *values):
+        self._extend(values)
+
+    def _stream_write(self, value):
+        self._buffer.append(value)
+        self._buffered += len(value)
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def _stream_extend(self, values):
+        self._buffer.extend(values)
+        self._buffered += sum(map(len, values))
+        if self._buffered >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write what has been buffered to the stream, encoded.
+        """
+        if self._buffer:
+            self._stream.write(u''.join(self._buffer).encode(self.encoding,
+                                                             self.errors))
+            del self._buffer[:]
+        self._buffered = 0
+
+    def resolve(self, names):
+        """
+        Bind every name that isn't in the namespace to the builtin of that
+        name or `Undefined`, the same values `__getitem__` would look up,
+        and return the namespace.  Code only looking up these names can
+        then run with the namespace dict itself instead of the context.
+        """
+        namespace = self._namespace
+        for name in names:
+            if name not in namespace:
+                namespace[name] = getattr(builtins, name, undefined)
+        return namespace
+
     def write(self, value):
         self._write(self.to_unicode(value))
 
@@ -410,14 +500,15 @@ class Template(object):
         'url_quote':        url_quote,
         'url_quote_plus':   url_quote_plus,
     }
+    # characters `render_to` collects before writing them to the stream
+    stream_buffer_size = 64 * 1024
 
     def __init__(self, source, filename='<template>', encoding='utf-8',
                  errors='strict', unicode_mode=True):
         if isinstance(source, str):
             source = source.decode(encoding, errors)
-        node = Parser(tokenize('\n'.join(source.splitlines()),
-                               filename), filename).parse()
-        self.code = ModuleCodeGenerator(transform(node, filename)).getCode()
+        self.code = compile_template(source, filename)
+        self.names = code_names(self.code)
         self.filename = filename
         self.encoding = encoding
         self.errors = errors
@@ -438,12 +529,108 @@ class Template(object):
                    errors, unicode_mode)
     from_file = classmethod(from_file)
 
+    def from_code(cls, code, filename='<template>', encoding='utf-8',
+                  errors='strict', unicode_mode=True):
+        rv = object.__new__(cls)
+        rv.code = code
+        rv.names = code_names(code)
+        rv.filename = filename
+        rv.encoding = encoding
+        rv.errors = errors
+        rv.unicode_mode = unicode_mode
+        return rv
+    from_code = classmethod(from_code)
+
     def render(self, *args, **kwargs):
         ns = self.default_context.copy()
         ns.update(*args, **kwargs)
         context = Context(ns, self.encoding, self.errors)
-        exec self.code in {}, context
+        exec self.code in context.resolve(self.names)
         return context.get_value(self.unicode_mode)
 
+    def render_to(self, stream, *args, **kwargs):
+        """
+        Render the template into a file like object.  The output is
+        written encoded, in chunks of about `stream_buffer_size`
+        characters, so it never is in memory as a whole.
+        """
+        ns = self.default_context.copy()
+        ns.update(*args, **kwargs)
+        context = Context(ns, self.encoding, self.errors, stream,
+                          self.stream_buffer_size)
+        exec self.code in context.resolve(self.names)
+        context.flush()
+
     def substitute(self, *args, **kwargs):
         return self.render(*args, **kwargs)
+
+
+class TemplateCache(object):
+    """
+    Compiled templates keyed by filename, modification time and size.  If
+    a `directory` is given, the marshalled code objects are stored there as
+    well, so later builds and other processes don't have to compile them
+    again.
+    """
+
+    def __init__(self, directory=None, encoding='utf-8', errors='strict',
+                 unicode_mode=True):
+        self.directory = directory
+        self.encoding = encoding
+        self.errors = errors
+        self.unicode_mode = unicode_mode
+        self._templates = {}
+
+    def get(self, filename):
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        key = (st.st_mtime, st.st_size)
+        cached = self._templates.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        code = self._load_code(filename, key)
+        if code is None:
+            f = open(filename, 'r')
+            try:
+                source = f.read().decode(self.encoding, self.errors)
+            finally:
+                f.close()
+            code = compile_template(source, filename)
+            self._dump_code(filename, key, code)
+        template = Template.from_code(code, filename, self.encoding,
+                                      self.errors, self.unicode_mode)
+        self._templates[filename] = (key, template)
+        return template
+
+    def _code_filename(self, filename):
+        return os.path.join(self.directory,
+                            md5(filename).hexdigest() + '.tplc')
+
+    def _load_code(self, filename, key):
+        if self.directory is None:
+            return None
+        try:
+            f = open(self._code_filename(filename), 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                magic, cached_key, code = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                return None
+        finally:
+            f.close()
+        if magic != imp.get_magic() or cached_key != key:
+            return None
+        return code
+
+    def _dump_code(self, filename, key, code):
+        if self.directory is None:
+            return
+        try:
+            # concurrent readers must never see a half written cache file
+            write_atomically(self._code_filename(filename),
+                             marshal.dumps((imp.get_magic(), key, code)))
+        except (IOError, OSError):
+            # the cache is an optimization only
+            pass
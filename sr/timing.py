@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+timing
+------
+
+Collects how long the phases of a build take: discovery, change checks,
+reading and hashing pages, markdown, code highlighting, loading and rendering
+templates and writing output files. Phases may be nested, e.g. highlighting
+happens during markdown conversion and is included in its time.
+
+Timings can be summarized with the slowest pages and templates, or written
+as a Chrome trace event file to be loaded into a trace viewer
+(chrome://tracing, Perfetto).
+"""
+
+import os
+import json
+import time
+
+class _Span(object):
+    """
+    context manager timing one occurrence of a phase
+    """
+    def __init__(self, timer, phase, page, template):
+        self.timer = timer
+        self.phase = phase
+        self.page = page
+        self.template = template
+
+    def __enter__(self):
+        if self.page is not None:
+            self.timer._pages.append(self.page)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.time() - self.start
+        if self.page is not None:
+            self.timer._pages.pop()
+        self.timer.add(self.phase, self.start, duration, self.page,
+                       self.template)
+        return False
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class NullTimer(object):
+    """
+    a timer that records nothing, used when not profiling
+    """
+    enabled = False
+
+    def timed(self, phase, page=None, template=None):
+        return _NullSpan()
+
+    def add(self, phase, start, duration, page=None, template=None):
+        pass
+
+    def drain(self):
+        return []
+
+    def merge(self, events):
+        pass
+
+class Timer(object):
+    """
+    records timed phases of a build
+
+    events are kept as (phase, start, duration, page, template, pid) tuples,
+    so those recorded in worker processes can be merged in
+    """
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+        # pages currently being rendered, phases without a page of their
+        # own are attributed to the innermost one
+        self._pages = []
+
+    def timed(self, phase, page=None, template=None):
+        """
+        time a phase
+
+            with timer.timed('markdown', page='index'):
+                ...
+
+        @param phase: name of the phase
+        @type phase: string
+        @keyword page: page the phase belongs to
+        @keyword template: template the phase belongs to
+        @return: context manager
+        """
+        return _Span(self, phase, page, template)
+
+    def add(self, phase, start, duration, page=None, template=None):
+        """
+        record a phase timed elsewhere
+
+        @param start: start time as returned by time.time()
+        @param duration: seconds the phase took
+        """
+        if page is None and self._pages:
+            page = self._pages[-1]
+        self.events.append((phase, start, duration, page, template,
+                            os.getpid()))
+
+    def drain(self):
+        """
+        return the events recorded so far and forget them
+        """
+        events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        """
+        add events recorded by another timer, e.g. in a worker process
+        """
+        self.events.extend(events)
+
+    def phase_totals(self):
+        """
+        @return: phase names mapped to total seconds and occurrences
+        @rtype: dict
+        """
+        totals = {}
+        for phase, start, duration, page, template, pid in self.events:
+            total = totals.setdefault(phase, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+        return totals
+
+    def slowest(self, phase, key, top=10):
+        """
+        names taking the longest in a phase
+
+        @param phase: phase to look at
+        @param key: "page" or "template"
+        @keyword top: number of names to return
+        @return: (seconds, name) tuples, slowest first
+        @rtype: list
+        """
+        index = {'page': 3, 'template': 4}[key]
+        totals = {}
+        for event in self.events:
+            if event[0] == phase and event[index] is not None:
+                totals[event[index]] = totals.get(event[index], 0.0) + \
+                                       event[2]
+        return sorted([(seconds, name) for name, seconds in
+                       totals.iteritems()], reverse=True)[:top]
+
+    def report(self, out, top=10):
+        """
+        print a summary of phase totals and the slowest pages and templates
+
+        @param out: file to print to
+        @keyword top: number of slowest pages and templates to show
+        """
+        print >> out, "Time per phase (nested phases are included in " \
+                      "their parents):"
+        totals = sorted(self.phase_totals().iteritems(),
+                        key=lambda item: item[1][0], reverse=True)
+        for phase, (seconds, count) in totals:
+            print >> out, " %-18s %9.3fs %8d times" % (phase, seconds, count)
+        print >> out, "Slowest pages:"
+        for seconds, page_name in self.slowest('page', 'page', top):
+            print >> out, " %9.3fs %s" % (seconds, page_name)
+        print >> out, "Slowest templates:"
+        for seconds, template_name in self.slowest('template render',
+                                                   'template', top):
+            print >> out, " %9.3fs %s" % (seconds, template_name)
+
+    def write_trace(self, filename):
+        """
+        write all events as a Chrome trace event file
+
+        @param filename: where to write the trace
+        @type filename: string
+        """
+        if self.events:
+            origin = min(event[1] for event in self.events)
+        trace_events = []
+        for phase, start, duration, page, template, pid in self.events:
+            args = {}
+            if page is not None:
+                args['page'] = page
+            if template is not None:
+                args['template'] = template
+            trace_events.append({
+                'name': phase,
+                'cat': 'sr',
+                'ph': 'X',
+                'ts': int((start - origin) * 1000000),
+                'dur': int(duration * 1000000),
+                'pid': pid,
+                'tid': pid,
+                'args': args,
+            })
+        trace_file = open(filename, 'w')
+        try:
+            json.dump({'traceEvents': trace_events}, trace_file)
+        finally:
+            trace_file.close()
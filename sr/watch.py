@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+"""
+Static Rendering
+================
+
+watch
+-----
+
+Keeps a project loaded and re-renders pages as soon as their source files,
+their templates or the project's config change. Changes are picked up with
+inotify if pyinotify is installed, otherwise the project directory is polled.
+"""
+
+import os
+import sys
+import time
+import traceback
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from libsr import Project
+
+class Watcher(object):
+    """
+    watch a project and render what changes
+    """
+    # time to wait for more changes after one was noticed, editors tend
+    # to write files in several steps
+    settle_time = 0.05
+
+    def __init__(self, directory, jobs=1, interval=1.0, out=sys.stdout):
+        """
+        load the project and bring it up to date
+
+        @param directory: path to the project directory
+        @type directory: string
+        @keyword jobs: number of worker processes for larger rebuilds
+        @keyword interval: seconds between scans when polling
+        @keyword out: where to report what has been rendered
+        """
+        self.directory = os.path.abspath(directory)
+        self.jobs = jobs
+        self.interval = interval
+        self.out = out
+        self.project = Project(self.directory)
+        self.config_filename = os.path.join(self.directory, 'config.ini')
+        self.report('Initial build', self.project.render(jobs=self.jobs))
+
+    def report(self, reason, result, started=None):
+        """
+        print what has been rendered
+        """
+        if not result[0]:
+            return
+        message = "%s: rendered %s" % (reason, ", ".join(result[0]))
+        if started is not None:
+            message += " (%.3fs)" % (time.time() - started)
+        print >> self.out, message
+
+    def handle(self, filenames):
+        """
+        render whatever is affected by changes to files
+
+        @param filenames: paths of changed files
+        @type filenames: iterable of strings
+        """
+        started = time.time()
+        filenames = set(os.path.abspath(filename) for filename in filenames)
+        if self.config_filename in filenames:
+            self.project.manifest.commit()
+            # the old project stays loaded if the new config can't be used
+            project = Project(self.directory)
+            self.project.manifest.close()
+            self.project = project
+            self.report('config.ini', self.project.render(jobs=self.jobs),
+                        started)
+            return
+        page_names = []
+        for filename in sorted(filenames):
+            if filename.startswith(self.project.template_dir + os.sep):
+                template_name = filename[len(self.project.template_dir +
+                                             os.sep):]
+                self.report(template_name,
+                            self.project.render_template_users(
+                                template_name, jobs=self.jobs
+                            ), started)
+            else:
+                page_name = self.project.page_name_for(filename)
+                if page_name is not None:
+                    page_names.append(page_name)
+        if page_names:
+            self.report('source', self.project.render_pages(page_names),
+                        started)
+
+    def run(self):
+        """
+        watch the project until interrupted
+
+        errors while rendering, e.g. from a template saved half-edited, are
+        printed and watching goes on
+        """
+        if pyinotify is not None:
+            changes = self._inotify_changes()
+        else:
+            changes = self._poll_changes()
+        for filenames in changes:
+            try:
+                try:
+                    self.handle(filenames)
+                except SystemExit, exit:
+                    # Project exits on configs it can't use
+                    print >> self.out, exit.code
+                except Exception, error:
+                    print >> self.out, "Error:", ''.join(
+                        traceback.format_exception_only(type(error), error)
+                    ).strip()
+            finally:
+                # keep what has been rendered before an error
+                self.project.manifest.commit()
+
+    def _watched_dirs(self):
+        return [self.project.source_dir, self.project.template_dir]
+
+    def _inotify_changes(self):
+        """
+        yield sets of changed files as reported by inotify
+        """
+        changed = set()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+               pyinotify.IN_DELETE
+        def collect(event):
+            changed.add(event.pathname)
+        watch_manager = pyinotify.WatchManager()
+        watch_manager.add_watch(self._watched_dirs(), mask, rec=True,
+                                auto_add=True)
+        watch_manager.add_watch(self.directory, mask)
+        notifier = pyinotify.Notifier(watch_manager, collect)
+        try:
+            while True:
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                    # pick up changes belonging to the same save
+                    while notifier.check_events(self.settle_time * 1000):
+                        notifier.read_events()
+                        notifier.process_events()
+                if changed:
+                    yield set(changed)
+                    changed.clear()
+        finally:
+            notifier.stop()
+
+    def _scan(self):
+        """
+        modification times and sizes of all watched files
+        """
+        state = {}
+        filenames = [self.config_filename]
+        for watched_dir in self._watched_dirs():
+            for dirpath, dirnames, dirfilenames in os.walk(watched_dir):
+                filenames.extend(os.path.join(dirpath, filename)
+                                 for filename in dirfilenames)
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            state[filename] = (stat.st_mtime, stat.st_size)
+        return state
+
+    def _poll_changes(self):
+        """
+        yield sets of changed files by comparing scans of the project
+        """
+        state = self._scan()
+        while True:
+            time.sleep(self.interval)
+            new_state = self._scan()
+            changed = set(filename for filename in
+                          set(state) | set(new_state)
+                          if state.get(filename) != new_state.get(filename))
+            state = new_state
+            if changed:
+                yield changed